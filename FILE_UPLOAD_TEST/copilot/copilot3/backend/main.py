@@ -3,18 +3,24 @@ import json
 import uuid
 import mimetypes
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Optional
+from urllib.parse import quote
 import re
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+import aiofiles
 import uvicorn
 
 # Configuration
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # 64KB
+# Stored files are never modified after upload, so clients may cache them indefinitely
+CACHE_CONTROL = "public, max-age=31536000, immutable"
 UPLOAD_DIR = Path("uploads")
 METADATA_FILE = Path("file_metadata.json")
 
@@ -37,7 +43,11 @@ BLOCKED_EXTENSIONS = {
     '.dll', '.so', '.dylib', '.msi', '.deb', '.rpm'
 }
 
-app = FastAPI(title="File Upload & Management System", version="1.0.0")
+app = FastAPI(
+    title="File Upload & Management System",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+)
 
 # CORS middleware for frontend
 app.add_middleware(
@@ -89,13 +99,19 @@ def save_metadata(metadata: dict):
     with open(METADATA_FILE, 'w', encoding='utf-8') as f:
         json.dump(metadata, f, indent=2, ensure_ascii=False)
 
+@lru_cache(maxsize=256)
+def guess_mime_type(file_extension: str) -> Optional[str]:
+    """Guess MIME type from a lowercase file extension (cached per extension)."""
+    guessed_type, _ = mimetypes.guess_type(f"file{file_extension}")
+    return guessed_type
+
 def validate_file_type(file: UploadFile) -> bool:
     """Validate if file type is allowed."""
     if not file.filename:
         return False
     
     # Check for blocked extensions first
-    file_extension = Path(file.filename).suffix.lower()
+    file_extension = os.path.splitext(file.filename)[1].lower()
     if file_extension in BLOCKED_EXTENSIONS:
         return False
     
@@ -103,8 +119,8 @@ def validate_file_type(file: UploadFile) -> bool:
     if file.content_type and file.content_type in ALLOWED_MIME_TYPES:
         return True
     
-    # Fallback: guess MIME type from filename
-    guessed_type, _ = mimetypes.guess_type(file.filename)
+    # Fallback: guess MIME type from the file extension
+    guessed_type = guess_mime_type(file_extension)
     if guessed_type and guessed_type in ALLOWED_MIME_TYPES:
         # Double-check that the extension is safe even if MIME type is allowed
         if file_extension in BLOCKED_EXTENSIONS:
@@ -113,6 +129,32 @@ def validate_file_type(file: UploadFile) -> bool:
     
     return False
 
+def content_disposition(filename: str) -> str:
+    """Build an attachment Content-Disposition header for the given filename."""
+    quoted_filename = quote(filename)
+    if quoted_filename != filename:
+        return f"attachment; filename*=utf-8''{quoted_filename}"
+    return f'attachment; filename="{filename}"'
+
+def file_etag(file_metadata: dict) -> str:
+    """Build a strong ETag from the immutable file ID and size."""
+    return f'"{file_metadata["id"]}-{file_metadata["file_size"]}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Check whether the request's If-None-Match header matches the ETag."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip() for tag in if_none_match.split(","))
+
+async def iter_file_chunks(file_path: str):
+    """Yield a stored file in fixed-size chunks without blocking the event loop."""
+    async with aiofiles.open(file_path, 'rb') as f:
+        while chunk := await f.read(DOWNLOAD_CHUNK_SIZE):
+            yield chunk
+
 # Ensure upload directory exists
 UPLOAD_DIR.mkdir(exist_ok=True)
 
@@ -136,9 +178,9 @@ async def upload_file(file: UploadFile = File(...)):
     sanitized_name = sanitize_filename(original_filename)
     
     # Create unique stored filename to avoid conflicts
-    file_extension = Path(sanitized_name).suffix
+    file_extension = os.path.splitext(sanitized_name)[1]
     stored_filename = f"{file_id}{file_extension}"
-    file_path = UPLOAD_DIR / stored_filename
+    file_path = os.path.join(UPLOAD_DIR, stored_filename)
     
     # Read file content and validate size
     content = await file.read()
@@ -158,7 +200,7 @@ async def upload_file(file: UploadFile = File(...)):
         original_filename=original_filename,
         stored_filename=stored_filename,
         file_size=len(content),
-        mime_type=file.content_type or mimetypes.guess_type(original_filename)[0] or "application/octet-stream",
+        mime_type=file.content_type or guess_mime_type(file_extension.lower()) or "application/octet-stream",
         upload_date=datetime.now().isoformat()
     )
     
@@ -173,13 +215,13 @@ async def upload_file(file: UploadFile = File(...)):
 async def list_files():
     """List all uploaded files with metadata."""
     metadata_db = load_metadata()
-    files = [FileMetadata(**data) for data in metadata_db.values()]
-    # Sort by upload date, newest first
-    files.sort(key=lambda x: x.upload_date, reverse=True)
-    return FileListResponse(files=files)
+    # Metadata is kept in upload order, so reversing it yields newest first
+    # without a sort. Entries were validated on upload, so they are returned
+    # as-is rather than being rebuilt as FileMetadata models.
+    return ORJSONResponse({"files": list(reversed(metadata_db.values()))})
 
 @app.get("/api/files/{file_id}")
-async def download_file(file_id: str):
+async def download_file(file_id: str, request: Request):
     """Download a specific file."""
     metadata_db = load_metadata()
     
@@ -187,15 +229,28 @@ async def download_file(file_id: str):
         raise HTTPException(status_code=404, detail="File not found")
     
     file_metadata = metadata_db[file_id]
-    file_path = UPLOAD_DIR / file_metadata["stored_filename"]
+    etag = file_etag(file_metadata)
+    cache_headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    
+    # Client already has this file cached
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=cache_headers)
     
-    if not file_path.exists():
+    file_path = os.path.join(UPLOAD_DIR, file_metadata["stored_filename"])
+    
+    try:
+        file_size = os.path.getsize(file_path)
+    except OSError:
         raise HTTPException(status_code=404, detail="File not found on disk")
     
-    return FileResponse(
-        path=str(file_path),
-        filename=file_metadata["original_filename"],
-        media_type=file_metadata["mime_type"]
+    return StreamingResponse(
+        iter_file_chunks(file_path),
+        media_type=file_metadata["mime_type"],
+        headers={
+            "Content-Length": str(file_size),
+            "Content-Disposition": content_disposition(file_metadata["original_filename"]),
+            **cache_headers,
+        }
     )
 
 @app.delete("/api/files/{file_id}")
@@ -207,12 +262,12 @@ async def delete_file(file_id: str):
         raise HTTPException(status_code=404, detail="File not found")
     
     file_metadata = metadata_db[file_id]
-    file_path = UPLOAD_DIR / file_metadata["stored_filename"]
+    file_path = os.path.join(UPLOAD_DIR, file_metadata["stored_filename"])
     
     # Delete file from disk if it exists
-    if file_path.exists():
+    if os.path.exists(file_path):
         try:
-            file_path.unlink()
+            os.remove(file_path)
         except OSError as e:
             raise HTTPException(status_code=500, detail=f"Failed to delete file: {str(e)}")
     
@@ -223,14 +278,22 @@ async def delete_file(file_id: str):
     return {"message": "File deleted successfully"}
 
 @app.get("/api/files/{file_id}/info", response_model=FileMetadata)
-async def get_file_info(file_id: str):
+async def get_file_info(file_id: str, request: Request, response: Response):
     """Get file metadata without downloading."""
     metadata_db = load_metadata()
     
     if file_id not in metadata_db:
         raise HTTPException(status_code=404, detail="File not found")
     
-    return FileMetadata(**metadata_db[file_id])
+    file_metadata = metadata_db[file_id]
+    etag = file_etag(file_metadata)
+    cache_headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=cache_headers)
+    
+    response.headers.update(cache_headers)
+    return FileMetadata(**file_metadata)
 
 @app.get("/")
 async def root():
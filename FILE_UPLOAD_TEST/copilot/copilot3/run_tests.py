@@ -4,7 +4,6 @@ Test runner script for the File Upload & Management System
 """
 import os
 import sys
-import subprocess
 from pathlib import Path
 
 def main():
@@ -43,21 +42,21 @@ def main():
         import main
         print("✅ Backend modules imported successfully")
         
-        # Run pytest
+        # Run pytest in-process (no second interpreter start-up)
+        import pytest
         print("🚀 Starting test execution...")
-        result = subprocess.run([
-            sys.executable, "-m", "pytest", 
-            "test_file_management.py", 
-            "-v", 
+        returncode = int(pytest.main([
+            "test_file_management.py",
+            "-v",
             "--tb=short"
-        ], env={**os.environ, "PYTHONPATH": backend_path})
+        ]))
         
-        if result.returncode == 0:
+        if returncode == 0:
             print("✅ All tests passed!")
         else:
             print("❌ Some tests failed!")
         
-        return result.returncode
+        return returncode
         
     except ImportError as e:
         print(f"❌ Failed to import backend modules: {e}")
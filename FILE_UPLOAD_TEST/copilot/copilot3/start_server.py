@@ -4,7 +4,6 @@ Startup script for the File Upload & Management System
 """
 import os
 import sys
-import subprocess
 from pathlib import Path
 
 def main():
@@ -39,14 +38,18 @@ def main():
     print("=" * 50)
     
     try:
-        # Start the FastAPI server
-        subprocess.run([sys.executable, "main.py"], check=True)
+        # Start the FastAPI server in-process (no second interpreter start-up)
+        sys.path.insert(0, str(backend_dir))
+        import uvicorn
+        from main import app
+        uvicorn.run(app, host="127.0.0.1", port=8000)
     except KeyboardInterrupt:
         print("\n🛑 Server stopped by user")
         return 0
-    except subprocess.CalledProcessError as e:
+    except ImportError as e:
         print(f"❌ Error starting server: {e}")
         return 1
+    return 0
 
 if __name__ == "__main__":
     sys.exit(main())
\ No newline at end of file
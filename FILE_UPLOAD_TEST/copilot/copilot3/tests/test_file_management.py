@@ -55,10 +55,10 @@ class TestFileUploadManagement:
         """Set up before each test method"""
         import main
         
-        # Clear uploads directory and metadata file
-        if main.UPLOAD_DIR.exists():
-            shutil.rmtree(main.UPLOAD_DIR)
+        # Clear uploaded files (cheaper than removing and recreating the directory)
         main.UPLOAD_DIR.mkdir(exist_ok=True)
+        for path in main.UPLOAD_DIR.iterdir():
+            path.unlink()
         
         if main.METADATA_FILE.exists():
             main.METADATA_FILE.unlink()
@@ -368,6 +368,34 @@ class TestFileUploadManagement:
         files_count = len(list_response.json()["files"])
         assert files_count == 3, f"Expected 3 files uploaded, got {files_count}"
 
+    # Test 11: Conditional Requests (ETag)
+    def test_conditional_requests_with_etag(self):
+        """Test ETag headers and 304 responses for download and info"""
+        filename, file_content, content_type = self.create_test_file("etag_test.txt", "Cached content")
+
+        upload_response = self.client.post(
+            "/api/files/upload",
+            files={"file": (filename, file_content, content_type)}
+        )
+        assert upload_response.status_code == 200
+        file_id = upload_response.json()["id"]
+
+        for url in (f"/api/files/{file_id}", f"/api/files/{file_id}/info"):
+            response = self.client.get(url)
+            assert response.status_code == 200
+            etag = response.headers["etag"]
+            assert "immutable" in response.headers["cache-control"]
+
+            # Matching ETag short-circuits with an empty 304
+            cached_response = self.client.get(url, headers={"If-None-Match": etag})
+            assert cached_response.status_code == 304
+            assert cached_response.content == b""
+            assert cached_response.headers["etag"] == etag
+
+            # Stale ETag returns the full response
+            stale_response = self.client.get(url, headers={"If-None-Match": '"stale"'})
+            assert stale_response.status_code == 200
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file
@@ -1,26 +1,21 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Response, Depends
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers
 from pathlib import Path
-import json
+import orjson
 import uuid
 import shutil
-from datetime import datetime
-from typing import List, Optional
-import mimetypes
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import List, Optional, Union
 import os
+import time
+import asyncio
+import threading
 
-app = FastAPI(title="File Upload & Management API")
-
-# CORS middleware to allow frontend requests
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app = FastAPI(title="File Upload & Management API", default_response_class=ORJSONResponse)
 
 # Configuration
 # Use absolute paths based on this file's location
@@ -28,55 +23,204 @@ BASE_DIR = Path(__file__).parent
 UPLOAD_DIR = BASE_DIR / "uploads"
 METADATA_FILE = BASE_DIR / "metadata.json"
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+# Allowance for multipart boundaries and part headers on top of the file itself
+MAX_REQUEST_SIZE = MAX_FILE_SIZE + 64 * 1024
+FILE_TOO_LARGE_DETAIL = f"File size exceeds maximum allowed size of {MAX_FILE_SIZE / (1024*1024):.1f}MB"
+UPLOAD_CHUNK_SIZE = 64 * 1024  # 64KB
+# Stored files never change after upload, so clients may cache them indefinitely
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+METADATA_FLUSH_DELAY = 0.1  # seconds to batch metadata changes before writing
+
+# In-memory metadata cache: read from METADATA_FILE once, then mutated in place
+# and written back to disk only when it changes
+_METADATA_CACHE: dict = {}  # file ID -> FileMeta
+_metadata_loaded = False
+_metadata_dirty = False
+_METADATA_LOCK = asyncio.Lock()
+# Serializes writes to METADATA_FILE: a cancelled flusher can leave a write
+# running in a worker thread while shutdown does its final flush
+_METADATA_IO_LOCK = threading.Lock()
+# Background flusher state (only set while the app is running)
+_metadata_flush_event: Optional[asyncio.Event] = None
+_metadata_flush_task: Optional[asyncio.Task] = None
 
 # Allowed file types
-ALLOWED_EXTENSIONS = {
+ALLOWED_EXTENSIONS = frozenset({
     # Images
     '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg',
     # PDFs
     '.pdf',
     # Text files
     '.txt', '.md', '.csv', '.json', '.xml', '.html', '.css', '.js', '.log'
-}
+})
 
-ALLOWED_MIME_TYPES = {
+ALLOWED_MIME_TYPES = frozenset({
     'image/jpeg', 'image/png', 'image/gif', 'image/bmp', 'image/webp', 'image/svg+xml',
     'application/pdf',
     'text/plain', 'text/markdown', 'text/csv', 'application/json', 'text/xml',
     'text/html', 'text/css', 'application/javascript', 'text/x-log'
+})
+
+# MIME type to store when the client doesn't send one, keyed by allowed extension
+EXT_TO_MIME = {
+    '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png',
+    '.gif': 'image/gif', '.bmp': 'image/bmp', '.webp': 'image/webp',
+    '.svg': 'image/svg+xml',
+    '.pdf': 'application/pdf',
+    '.txt': 'text/plain', '.md': 'text/markdown', '.csv': 'text/csv',
+    '.json': 'application/json', '.xml': 'text/xml', '.html': 'text/html',
+    '.css': 'text/css', '.js': 'application/javascript', '.log': 'text/plain'
 }
 
 
+class UploadSizeLimitMiddleware:
+    """Reject uploads whose declared Content-Length is too large before the body is read"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/api/files/upload":
+            try:
+                declared = int(Headers(scope=scope).get("content-length", 0))
+            except ValueError:
+                declared = 0
+            if declared > MAX_REQUEST_SIZE:
+                response = JSONResponse(status_code=413, content={"detail": FILE_TOO_LARGE_DETAIL})
+                await response(scope, receive, send)
+                return
+        # Uploads without Content-Length (chunked) are still limited while streaming
+        await self.app(scope, receive, send)
+
+
+# Registered before CORS so CORS headers are still added to its responses
+app.add_middleware(UploadSizeLimitMiddleware)
+
+# CORS middleware to allow frontend requests
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
 def ensure_directories():
     """Create necessary directories if they don't exist"""
     UPLOAD_DIR.mkdir(exist_ok=True)
 
 
-def load_metadata() -> dict:
-    """Load metadata from JSON file"""
+@dataclass(slots=True)
+class FileMeta:
+    """Metadata for one stored file (orjson and FastAPI serialize it like a dict)"""
+    id: str
+    original_filename: str
+    stored_filename: str
+    file_size: int
+    mime_type: str
+    # datetime for new uploads, ISO string once read back from METADATA_FILE
+    upload_date: Union[datetime, str]
+    upload_ts: int = 0
+    etag: str = ""
+
+
+def read_metadata_file() -> dict:
+    """Read metadata from JSON file"""
     if METADATA_FILE.exists():
         try:
-            with open(METADATA_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
+            with open(METADATA_FILE, 'rb') as f:
+                return orjson.loads(f.read())
+        except (orjson.JSONDecodeError, IOError):
             return {}
     return {}
 
 
-def save_metadata(metadata: dict):
-    """Save metadata to JSON file"""
-    with open(METADATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(metadata, f, indent=2, ensure_ascii=False)
+def load_metadata() -> dict:
+    """Return the in-memory metadata cache, reading the JSON file on first use"""
+    global _metadata_loaded
+    if not _metadata_loaded:
+        _METADATA_CACHE.update(
+            (file_id, FileMeta(**entry)) for file_id, entry in read_metadata_file().items()
+        )
+        _metadata_loaded = True
+    return _METADATA_CACHE
+
+
+async def get_metadata() -> dict:
+    """Dependency providing the shared metadata cache to endpoints (async so it skips the threadpool)"""
+    return _METADATA_CACHE if _metadata_loaded else load_metadata()
+
+
+def save_metadata(metadata: dict, sync: bool = False):
+    """Save metadata to JSON file atomically (write temp file, then replace)"""
+    payload = memoryview(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
+    tmp_file = METADATA_FILE.with_suffix('.json.tmp')
+    # Raw fd writes straight from the serialized buffer, no file object copy
+    fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while payload:
+            payload = payload[os.write(fd, payload):]
+        if sync:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp_file, METADATA_FILE)
+
+
+def flush_metadata(sync: bool = False):
+    """Write the metadata cache to disk if it has unsaved changes"""
+    global _metadata_dirty
+    with _METADATA_IO_LOCK:
+        if _metadata_dirty or sync:
+            # Clear the flag before writing so changes made meanwhile are flushed later
+            _metadata_dirty = False
+            save_metadata(dict(_METADATA_CACHE), sync=sync)
+
+
+def mark_metadata_dirty():
+    """Record a metadata change and schedule it to be written to disk"""
+    global _metadata_dirty
+    _metadata_dirty = True
+    if _metadata_flush_event is not None:
+        _metadata_flush_event.set()
+    else:
+        # No background flusher running (e.g. app used without lifespan events)
+        flush_metadata()
+
+
+async def metadata_flush_loop():
+    """Batch metadata changes and write them once per METADATA_FLUSH_DELAY"""
+    while True:
+        await _metadata_flush_event.wait()
+        await asyncio.sleep(METADATA_FLUSH_DELAY)
+        _metadata_flush_event.clear()
+        await asyncio.to_thread(flush_metadata)
+
+
+def write_upload(source, file_path: Path) -> int:
+    """Copy an upload to disk in chunks and return the bytes read (stops once over MAX_FILE_SIZE)"""
+    file_size = 0
+    with open(file_path, 'wb', buffering=1024 * 1024) as f:
+        while chunk := source.read(UPLOAD_CHUNK_SIZE):
+            file_size += len(chunk)
+            if file_size > MAX_FILE_SIZE:
+                break
+            f.write(chunk)
+    return file_size
+
+
+# Characters stripped from uploaded filenames
+_SANITIZE_TABLE = str.maketrans('', '', '/\\\x00<>|?*:"')
 
 
 def sanitize_filename(filename: str) -> str:
     """Sanitize filename to prevent path traversal and other security issues"""
     # Remove path components
     filename = os.path.basename(filename)
-    # Remove or replace dangerous characters
-    dangerous_chars = ['..', '/', '\\', '\x00']
-    for char in dangerous_chars:
-        filename = filename.replace(char, '')
+    # Remove dangerous characters in a single pass, then any '..' sequences
+    filename = filename.translate(_SANITIZE_TABLE).replace('..', '')
     # Remove leading/trailing dots and spaces
     filename = filename.strip('. ')
     # If empty after sanitization, use a default name
@@ -85,17 +229,26 @@ def sanitize_filename(filename: str) -> str:
     return filename
 
 
-def is_allowed_file(filename: str, content_type: Optional[str] = None) -> bool:
+def get_extension(filename: str) -> str:
+    """Return the lowercase file extension (including the dot)"""
+    # Plain string ops instead of Path(filename).suffix, which builds a PurePath
+    # per call; like Path.suffix, '.hidden' and 'name.' have no extension
+    stem, dot, ext = filename.rpartition('.')
+    return dot + ext.lower() if stem and ext else ''
+
+
+def is_allowed_file(filename: str, content_type: Optional[str] = None, ext: Optional[str] = None) -> bool:
     """Check if file type is allowed"""
     # Check extension
-    ext = Path(filename).suffix.lower()
+    if ext is None:
+        ext = get_extension(filename)
     has_valid_extension = ext in ALLOWED_EXTENSIONS
     
     # Check MIME type if provided
     has_valid_mime = False
     if content_type:
-        # Handle MIME type variations
-        base_type = content_type.split(';')[0].strip()
+        # Handle MIME type variations (drop parameters such as charset)
+        base_type = content_type.partition(';')[0].strip()
         has_valid_mime = base_type in ALLOWED_MIME_TYPES
     
     # Allow if either extension or MIME type is valid
@@ -103,120 +256,165 @@ def is_allowed_file(filename: str, content_type: Optional[str] = None) -> bool:
     return has_valid_extension or has_valid_mime
 
 
+def file_etag(file_info: FileMeta) -> str:
+    """Return the ETag for a stored file (falls back to the ID for older metadata)"""
+    return file_info.etag or f'"{file_info.id}"'
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """Check whether the client's If-None-Match header matches the ETag"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))
+
+
 @app.on_event("startup")
 async def startup_event():
-    """Initialize directories on startup"""
+    """Initialize directories, metadata cache and metadata flusher on startup"""
+    global _metadata_flush_event, _metadata_flush_task
     ensure_directories()
+    load_metadata()
+    _metadata_flush_event = asyncio.Event()
+    _metadata_flush_task = asyncio.create_task(metadata_flush_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the metadata flusher and write any pending metadata changes"""
+    global _metadata_flush_event, _metadata_flush_task
+    if _metadata_flush_task is not None:
+        _metadata_flush_task.cancel()
+        try:
+            await _metadata_flush_task
+        except asyncio.CancelledError:
+            pass
+    _metadata_flush_event = None
+    _metadata_flush_task = None
+    # Only fsync here; regular flushes leave durability to the OS page cache
+    flush_metadata(sync=True)
 
 
 @app.post("/api/files/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = File(...), metadata: dict = Depends(get_metadata)):
     """Upload a file and return metadata"""
     # Sanitize filename first to prevent path traversal attacks
     sanitized_filename = sanitize_filename(file.filename)
+    ext = get_extension(sanitized_filename)
     
     # Validate file type using sanitized filename
-    if not is_allowed_file(sanitized_filename, file.content_type):
+    if not is_allowed_file(sanitized_filename, file.content_type, ext):
         raise HTTPException(
             status_code=400,
             detail="File type not allowed. Only images, PDFs, and text files are permitted."
         )
     
-    # Read file content
-    content = await file.read()
-    
-    # Check file size
-    if len(content) > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=400,
-            detail=f"File size exceeds maximum allowed size of {MAX_FILE_SIZE / (1024*1024):.1f}MB"
-        )
-    
     # Generate unique ID and use sanitized filename
-    file_id = str(uuid.uuid4())
+    file_id = uuid.uuid4().hex
     original_filename = sanitized_filename
-    stored_filename = f"{file_id}_{original_filename}"
+    stored_filename = f"{file_id}{ext}"
     
-    # Save file
+    # Stream file to disk in a worker thread so the event loop isn't blocked
     file_path = UPLOAD_DIR / stored_filename
-    with open(file_path, 'wb') as f:
-        f.write(content)
-    
-    # Create metadata
-    metadata = {
-        "id": file_id,
-        "original_filename": original_filename,
-        "stored_filename": stored_filename,
-        "file_size": len(content),
-        "mime_type": file.content_type or mimetypes.guess_type(original_filename)[0] or "application/octet-stream",
-        "upload_date": datetime.utcnow().isoformat()
-    }
+    file_size = await asyncio.to_thread(write_upload, file.file, file_path)
+    
+    # Check file size
+    if file_size > MAX_FILE_SIZE:
+        file_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=413, detail=FILE_TOO_LARGE_DETAIL)
+    
+    # Create metadata (upload_date is left as a datetime; it is only formatted
+    # to ISO 8601 when serialized, upload_ts gives a cheap integer sort key)
+    upload_ts = time.time_ns()
+    file_info = FileMeta(
+        id=file_id,
+        original_filename=original_filename,
+        stored_filename=stored_filename,
+        file_size=file_size,
+        mime_type=file.content_type or EXT_TO_MIME.get(ext, "application/octet-stream"),
+        upload_date=datetime.fromtimestamp(upload_ts / 1e9, tz=timezone.utc),
+        upload_ts=upload_ts,
+        etag=f'"{file_id}"'
+    )
     
     # Save metadata
-    all_metadata = load_metadata()
-    all_metadata[file_id] = metadata
-    save_metadata(all_metadata)
+    async with _METADATA_LOCK:
+        metadata[file_id] = file_info
+        mark_metadata_dirty()
     
-    return metadata
+    return file_info
 
 
 @app.get("/api/files/")
-async def list_files():
-    """List all uploaded files with metadata"""
-    metadata = load_metadata()
-    return list(metadata.values())
+async def list_files(metadata: dict = Depends(get_metadata)):
+    """List all uploaded files with metadata, newest first"""
+    # Metadata is kept in upload order, so reversing it avoids a sort
+    return list(reversed(metadata.values()))
 
 
 @app.get("/api/files/{file_id}")
-async def download_file(file_id: str):
+async def download_file(file_id: str, request: Request, metadata: dict = Depends(get_metadata)):
     """Download a specific file"""
-    metadata = load_metadata()
-    
     if file_id not in metadata:
         raise HTTPException(status_code=404, detail="File not found")
     
     file_info = metadata[file_id]
-    file_path = UPLOAD_DIR / file_info["stored_filename"]
+    cache_headers = {"ETag": file_etag(file_info), "Cache-Control": CACHE_CONTROL}
+    
+    # Client already has this file cached, skip the disk entirely
+    if is_not_modified(request, cache_headers["ETag"]):
+        return Response(status_code=304, headers=cache_headers)
     
-    if not file_path.exists():
+    file_path = UPLOAD_DIR / file_info.stored_filename
+    
+    # Stat once here and hand the result to FileResponse so it doesn't stat again
+    try:
+        stat_result = os.stat(file_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found on disk")
     
     return FileResponse(
         path=file_path,
-        filename=file_info["original_filename"],
-        media_type=file_info["mime_type"]
+        filename=file_info.original_filename,
+        media_type=file_info.mime_type,
+        stat_result=stat_result,
+        headers=cache_headers
     )
 
 
 @app.get("/api/files/{file_id}/info")
-async def get_file_info(file_id: str):
+async def get_file_info(file_id: str, request: Request, response: Response,
+                        metadata: dict = Depends(get_metadata)):
     """Get file metadata without downloading"""
-    metadata = load_metadata()
-    
     if file_id not in metadata:
         raise HTTPException(status_code=404, detail="File not found")
     
-    return metadata[file_id]
+    file_info = metadata[file_id]
+    cache_headers = {"ETag": file_etag(file_info), "Cache-Control": CACHE_CONTROL}
+    
+    if is_not_modified(request, cache_headers["ETag"]):
+        return Response(status_code=304, headers=cache_headers)
+    
+    response.headers.update(cache_headers)
+    return file_info
 
 
 @app.delete("/api/files/{file_id}")
-async def delete_file(file_id: str):
+async def delete_file(file_id: str, metadata: dict = Depends(get_metadata)):
     """Delete a file and its metadata"""
-    metadata = load_metadata()
-    
     if file_id not in metadata:
         raise HTTPException(status_code=404, detail="File not found")
     
     file_info = metadata[file_id]
-    file_path = UPLOAD_DIR / file_info["stored_filename"]
+    file_path = UPLOAD_DIR / file_info.stored_filename
     
-    # Delete file from disk
-    if file_path.exists():
-        file_path.unlink()
+    # Delete file from disk (already missing is fine, no separate exists() stat)
+    file_path.unlink(missing_ok=True)
     
     # Remove from metadata
-    del metadata[file_id]
-    save_metadata(metadata)
+    async with _METADATA_LOCK:
+        metadata.pop(file_id, None)
+        mark_metadata_dirty()
     
     return {"message": "File deleted successfully", "file_id": file_id}
 
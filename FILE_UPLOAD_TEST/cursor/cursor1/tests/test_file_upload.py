@@ -4,27 +4,33 @@ import json
 import shutil
 from pathlib import Path
 from fastapi.testclient import TestClient
-from backend.main import app, UPLOAD_DIR, METADATA_FILE
+from backend.main import app, UPLOAD_DIR, METADATA_FILE, load_metadata
 
 # Setup test client
 client = TestClient(app)
 
 
+@pytest.fixture(scope="module", autouse=True)
+def upload_dir():
+    """Create the upload directory once per module and remove it at the end"""
+    UPLOAD_DIR.mkdir(exist_ok=True)
+    yield UPLOAD_DIR
+    shutil.rmtree(UPLOAD_DIR, ignore_errors=True)
+
+
 @pytest.fixture(autouse=True)
-def setup_and_teardown():
+def setup_and_teardown(upload_dir):
     """Setup and teardown for each test"""
-    # Create test upload directory
-    UPLOAD_DIR.mkdir(exist_ok=True)
-    
     # Clear metadata before each test
     if METADATA_FILE.exists():
         METADATA_FILE.unlink()
+    load_metadata().clear()
     
     yield
     
-    # Cleanup after each test
-    if UPLOAD_DIR.exists():
-        shutil.rmtree(UPLOAD_DIR)
+    # Remove only the files this test uploaded, keeping the directory
+    for path in upload_dir.iterdir():
+        path.unlink()
     if METADATA_FILE.exists():
         METADATA_FILE.unlink()
 
@@ -48,6 +54,7 @@ def test_upload_valid_file():
     assert data["file_size"] == len(test_file_content)
     assert data["mime_type"] == "image/jpeg"
     assert "upload_date" in data
+    assert isinstance(data["upload_ts"], int)
     
     # Verify file exists on disk
     stored_path = UPLOAD_DIR / data["stored_filename"]
@@ -79,6 +86,9 @@ def test_list_files():
     filenames = [f["original_filename"] for f in files]
     assert "test1.txt" in filenames
     assert "test2.pdf" in filenames
+    
+    # Newest upload is listed first
+    assert filenames == ["test2.pdf", "test1.txt"]
 
 
 def test_download_file():
@@ -98,6 +108,29 @@ def test_download_file():
     assert "download_test.txt" in response.headers.get("content-disposition", "")
 
 
+def test_conditional_download():
+    """Test ETag headers and If-None-Match handling for download and info"""
+    test_file = ("etag_test.txt", b"cacheable content", "text/plain")
+    upload_response = client.post("/api/files/upload", files={"file": test_file})
+    file_id = upload_response.json()["id"]
+    
+    for url in (f"/api/files/{file_id}", f"/api/files/{file_id}/info"):
+        response = client.get(url)
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        assert file_id in etag
+        assert "immutable" in response.headers["cache-control"]
+        
+        # Matching ETag returns an empty 304
+        cached = client.get(url, headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+        assert cached.content == b""
+        
+        # Non-matching ETag returns the full response
+        stale = client.get(url, headers={"If-None-Match": '"other"'})
+        assert stale.status_code == 200
+
+
 def test_delete_file():
     """Test deleting a file"""
     # Upload a file
@@ -170,9 +203,12 @@ def test_file_size_limit():
     
     response = client.post("/api/files/upload", files={"file": test_file})
     
-    assert response.status_code == 400
+    assert response.status_code == 413
     data = response.json()
     assert "size" in data["detail"].lower() or "exceed" in data["detail"].lower()
+    
+    # Rejected from Content-Length alone, so nothing was written to disk
+    assert not any(UPLOAD_DIR.iterdir())
 
 
 def test_filename_sanitization():
@@ -209,3 +245,36 @@ def test_nonexistent_file_delete():
     assert response.status_code == 404
     assert "not found" in response.json()["detail"].lower()
 
+
+def test_metadata_flushed_on_shutdown():
+    """Test that batched metadata writes are persisted when the app shuts down"""
+    with TestClient(app) as lifespan_client:
+        test_file = ("flush_test.txt", b"flush content", "text/plain")
+        response = lifespan_client.post("/api/files/upload", files={"file": test_file})
+        assert response.status_code == 200
+        file_id = response.json()["id"]
+        
+        # Served from the in-memory cache even before it reaches disk
+        info_response = lifespan_client.get(f"/api/files/{file_id}/info")
+        assert info_response.status_code == 200
+    
+    # Shutdown flushes pending changes to disk
+    with open(METADATA_FILE, 'r') as f:
+        metadata = json.load(f)
+        assert file_id in metadata
+
+
+def test_concurrent_metadata_flushes():
+    """Test that overlapping flushes (e.g. a cancelled flusher and the shutdown flush) don't collide on the temp file"""
+    from concurrent.futures import ThreadPoolExecutor
+    from backend.main import flush_metadata
+    
+    test_file = ("concurrent_flush.txt", b"flush content", "text/plain")
+    file_id = client.post("/api/files/upload", files={"file": test_file}).json()["id"]
+    
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for future in [pool.submit(flush_metadata, sync=True) for _ in range(64)]:
+            future.result()
+    
+    with open(METADATA_FILE, 'r') as f:
+        assert file_id in json.load(f)
@@ -1,18 +1,50 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, status
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request, status
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers
 import os
-import json
+import orjson
 import uuid
+import hashlib
 import shutil
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
-from typing import List, Optional
-import mimetypes
+from typing import List, Literal, Optional
 import re
+from urllib.parse import quote
+import asyncio
+import threading
+import weakref
+from cachetools import LRUCache
+from sortedcontainers import SortedList
 
 app = FastAPI(title="File Upload & Management API")
 
+
+class UploadSizeLimitMiddleware:
+    """Reject uploads whose declared Content-Length is too large before the body is read."""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/api/files/upload":
+            try:
+                declared = int(Headers(scope=scope).get("content-length", 0))
+            except ValueError:
+                declared = 0
+            if declared > MAX_REQUEST_SIZE:
+                response = JSONResponse(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, content={"detail": FILE_TOO_LARGE_DETAIL})
+                await response(scope, receive, send)
+                return
+        # Chunked uploads without Content-Length are still limited while streaming
+        await self.app(scope, receive, send)
+
+
+# Registered before CORS so CORS headers are still added to its responses
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # CORS middleware to allow frontend requests
 app.add_middleware(
     CORSMiddleware,
@@ -26,26 +58,77 @@ app.add_middleware(
 UPLOAD_DIR = Path("uploads")
 METADATA_FILE = Path("metadata.json")
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB in bytes
+# Headroom for the multipart boundaries and part headers around the file
+MAX_REQUEST_SIZE = MAX_FILE_SIZE + 64 * 1024
+FILE_TOO_LARGE_DETAIL = f"File size exceeds maximum allowed size of {MAX_FILE_SIZE / (1024*1024)}MB"
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB read/write chunks when copying uploads to disk
+
+# Stored files are sharded into two levels of subdirectories by the first
+# four hex characters of their UUID, keeping directory sizes bounded. The
+# scheme version is recorded per entry to allow future migrations.
+SHARD_SCHEME = 1
+
+# Stored files never change after upload, but browsers revalidate after an
+# hour so deleted files stop being served from their cache
+CACHE_CONTROL = "private, max-age=3600"
+
+# Serve downloads via nginx X-Accel-Redirect instead of streaming them from Python.
+# Requires an internal nginx location mapping XACCEL_PREFIX to the uploads dir:
+#   location /_protected_uploads/ { internal; alias /path/to/uploads/; }
+USE_XACCEL = os.getenv("USE_XACCEL", "").lower() in ("1", "true", "yes")
+XACCEL_PREFIX = os.getenv("XACCEL_PREFIX", "/_protected_uploads/")
+
+# At most this many uploads are copied to disk at once; the rest wait their
+# turn so bursts don't compete for disk bandwidth and worker threads
+MAX_CONCURRENT_UPLOADS = int(os.getenv("MAX_CONCURRENT_UPLOADS", "8"))
+_UPLOAD_SEM = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+
+# Small files are kept in an in-memory LRU (keyed by stored filename, so
+# deduplicated uploads share an entry) to serve repeat downloads from RAM
+DOWNLOAD_CACHE_MAX_FILE_SIZE = 256 * 1024  # 256KB
+DOWNLOAD_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 64MB total
+_DOWNLOAD_CACHE = LRUCache(maxsize=DOWNLOAD_CACHE_MAX_BYTES, getsizeof=len)
+
+
+class _FdPool(LRUCache):
+    """LRU of read-only file descriptors that closes them when they are evicted."""
+    
+    def popitem(self):
+        key, fd = super().popitem()
+        os.close(fd)
+        return key, fd
 
-# Allowed file types (MIME types)
-ALLOWED_MIME_TYPES = {
-    "image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp",
-    "application/pdf",
-    "text/plain", "text/html", "text/css", "text/javascript", "text/csv"
-}
 
-# Allowed file extensions (for additional validation)
-ALLOWED_EXTENSIONS = {
+# Larger files are streamed from pooled descriptors (keyed by stored filename)
+# so repeated downloads skip the path lookup and open() of the same file
+FD_POOL_SIZE = 128
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+_FD_POOL = _FdPool(maxsize=FD_POOL_SIZE)
+
+# Allowed file extensions
+ALLOWED_EXTENSIONS = frozenset({
     ".jpg", ".jpeg", ".png", ".gif", ".webp",
     ".pdf",
     ".txt", ".html", ".css", ".js", ".csv"
+})
+
+# MIME type for each allowed extension, instead of consulting the system
+# mime.types database through the mimetypes module
+_EXT_TO_MIME = {
+    ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png",
+    ".gif": "image/gif", ".webp": "image/webp",
+    ".pdf": "application/pdf",
+    ".txt": "text/plain", ".html": "text/html", ".css": "text/css",
+    ".js": "text/javascript", ".csv": "text/csv"
 }
 
+# Characters replaced in uploaded filenames (compiled once at import)
+_SANITIZE_RE = re.compile(r'[<>:"|?*\x00-\x1f]')
+
 # Initialize directories and metadata file
 UPLOAD_DIR.mkdir(exist_ok=True)
 if not METADATA_FILE.exists():
-    with open(METADATA_FILE, "w") as f:
-        json.dump({}, f)
+    METADATA_FILE.write_bytes(b"{}")
 
 
 def sanitize_filename(filename: str) -> str:
@@ -53,60 +136,285 @@ def sanitize_filename(filename: str) -> str:
     # Remove path components
     filename = os.path.basename(filename)
     # Remove or replace dangerous characters
-    filename = re.sub(r'[<>:"|?*\x00-\x1f]', '_', filename)
+    filename = _SANITIZE_RE.sub('_', filename)
     # Limit length
     filename = filename[:255]
     return filename
 
 
-def is_allowed_file(filename: str, mime_type: Optional[str] = None) -> bool:
-    """Check if file type is allowed."""
-    # Check extension
-    ext = Path(filename).suffix.lower()
-    if ext not in ALLOWED_EXTENSIONS:
-        return False
+def _shard_path(stored_filename: str) -> Path:
+    """Return the sharded location of a stored file: uploads/ab/cd/abcd...ext."""
+    return UPLOAD_DIR / stored_filename[:2] / stored_filename[2:4] / stored_filename
+
+
+def stored_file_path(entry: dict) -> Path:
+    """Return where an entry's file is stored (flat for entries from before sharding)."""
+    if entry.get("shard_scheme") == SHARD_SCHEME:
+        return _shard_path(entry["stored_filename"])
+    return UPLOAD_DIR / entry["stored_filename"]
+
+
+def get_extension(filename: str) -> str:
+    """Return the file extension including the dot, like Path(filename).suffix."""
+    # String ops only, no PurePath object per call; dotfiles and names
+    # ending in a dot have no extension
+    stem, dot, ext = filename.rpartition("/")[2].rpartition(".")
+    return dot + ext if stem and ext else ""
+
+
+def is_allowed_file(filename: str) -> bool:
+    """Check if file type is allowed (by extension; the declared MIME type is only stored)."""
+    return get_extension(filename).lower() in ALLOWED_EXTENSIONS
+
+
+def read_metadata_file() -> dict:
+    """Read metadata from JSON file."""
+    try:
+        return orjson.loads(METADATA_FILE.read_bytes())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return {}
+
+
+# Authoritative metadata, loaded once and mutated in place by the handlers;
+# METADATA_FILE is only written to persist it
+METADATA: dict = read_metadata_file()
+_METADATA_LOCK = asyncio.Lock()
+
+
+def _build_sha256_index() -> dict:
+    """Map each content hash to the IDs of the entries that have that content."""
+    index = {}
+    for entry in METADATA.values():
+        if "sha256" in entry:
+            index.setdefault(entry["sha256"], set()).add(entry["id"])
+    return index
+
+
+# Content hash -> file IDs, used to store identical uploads only once
+_SHA256_INDEX: dict = _build_sha256_index()
+
+
+def find_duplicate(digest: str) -> Optional[dict]:
+    """Return an existing entry whose stored file has the given content hash."""
+    for other_id in _SHA256_INDEX.get(digest, ()):
+        entry = METADATA.get(other_id)
+        if entry is not None and entry.get("sha256") == digest:
+            return entry
+    return None
+
+
+def release_stored_file(entry: dict) -> bool:
+    """Unregister an entry from the hash index; return True if its stored file is no longer used."""
+    file_ids = _SHA256_INDEX.get(entry.get("sha256"))
+    if file_ids is None:
+        return True
+    file_ids.discard(entry["id"])
+    # Drop IDs whose entries are gone, then see if anyone else shares the file
+    file_ids.intersection_update(METADATA)
+    if not file_ids:
+        del _SHA256_INDEX[entry["sha256"]]
+    return not any(METADATA[i]["stored_filename"] == entry["stored_filename"] for i in file_ids)
+
+
+# (upload_date, file_id) pairs kept in sorted order, so listings are sliced
+# instead of re-sorted on every request
+_BY_DATE = SortedList((entry.get("upload_date", ""), entry["id"]) for entry in METADATA.values())
+
+
+def page_by_date(offset: int, limit: Optional[int], newest_first: bool) -> list:
+    """Return one page of file IDs ordered by upload date (all of them without a limit)."""
+    if limit is None:
+        limit = len(_BY_DATE)
+    if newest_first:
+        end = len(_BY_DATE) - offset
+        page = _BY_DATE.islice(max(end - limit, 0), max(end, 0), reverse=True)
+    else:
+        page = _BY_DATE.islice(offset, offset + limit)
+    return [file_id for _, file_id in page]
+
+
+def load_metadata() -> dict:
+    """Return the in-memory metadata."""
+    return METADATA
+
+
+def _private_opener(path, flags):
+    """Opener creating uploaded files readable only by the server process."""
+    return os.open(path, flags, 0o600)
+
+
+def write_upload(source, file_path: Path, hasher) -> int:
+    """Copy an upload's spooled file to disk, hashing it; return the bytes read (stops past MAX_FILE_SIZE)."""
+    size = 0
+    with open(file_path, "xb", opener=_private_opener) as dst:
+        while chunk := source.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > MAX_FILE_SIZE:
+                break
+            hasher.update(chunk)
+            dst.write(chunk)
+    return size
+
+
+def pooled_fd(file_path: Path, stored_filename: str) -> int:
+    """Return a pooled read-only descriptor for a stored file, opening it on a miss."""
+    fd = _FD_POOL.get(stored_filename)
+    if fd is None:
+        fd = os.open(file_path, os.O_RDONLY | os.O_CLOEXEC)
+        _FD_POOL[stored_filename] = fd
+    return fd
+
+
+def close_pooled_fd(stored_filename: str):
+    """Drop a stored file's descriptor from the pool and close it."""
+    fd = _FD_POOL.pop(stored_filename, None)
+    if fd is not None:
+        os.close(fd)
+
+
+class PooledFileReader:
+    """Async iterator over a file read with pread() from a private duplicate of a pooled descriptor."""
     
-    # Check MIME type if provided
-    if mime_type:
-        # Handle common MIME type variations
-        mime_type = mime_type.lower().split(';')[0].strip()
-        if mime_type not in ALLOWED_MIME_TYPES:
-            # Fallback: check if extension matches known MIME types
-            mime_guess = mimetypes.guess_type(filename)[0]
-            if mime_guess and mime_guess.lower() not in ALLOWED_MIME_TYPES:
-                return False
+    def __init__(self, fd: int, size: int):
+        # The duplicate stays valid even if the pooled descriptor is evicted
+        # or closed mid-download, and is closed once the reader is done or dropped
+        self.fd = os.dup(fd)
+        self.size = size
+        self._close = weakref.finalize(self, os.close, self.fd)
     
-    return True
+    async def __aiter__(self):
+        try:
+            offset = 0
+            while offset < self.size:
+                chunk = await asyncio.to_thread(os.pread, self.fd, DOWNLOAD_CHUNK_SIZE, offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                yield chunk
+        finally:
+            self._close()
 
 
-def load_metadata() -> dict:
-    """Load metadata from JSON file."""
+def cache_headers(entry: dict) -> dict:
+    """Build the validator and caching headers for a stored file."""
+    uploaded = datetime.fromisoformat(entry["upload_date"])
+    return {
+        "ETag": f'"{entry["stored_filename"]}"',
+        "Last-Modified": formatdate(uploaded.timestamp(), usegmt=True),
+        "Cache-Control": CACHE_CONTROL,
+    }
+
+
+def is_not_modified(request: Request, headers: dict) -> bool:
+    """Check the request's If-None-Match / If-Modified-Since against a file's validators."""
+    # If-None-Match takes precedence; If-Modified-Since is only used without it
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return if_none_match.strip() == "*" or headers["ETag"] in (tag.strip() for tag in if_none_match.split(","))
+    if_modified_since = request.headers.get("if-modified-since")
+    if not if_modified_since:
+        return False
     try:
-        with open(METADATA_FILE, "r") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return parsedate_to_datetime(headers["Last-Modified"]) <= since
+
+
+def content_disposition(filename: str) -> str:
+    """Build an attachment Content-Disposition header for the given filename."""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
 
 
 def save_metadata(metadata: dict):
-    """Save metadata to JSON file."""
-    with open(METADATA_FILE, "w") as f:
-        json.dump(metadata, f, indent=2, default=str)
+    """Save metadata to JSON file atomically (write a temp file, then replace)."""
+    tmp_file = METADATA_FILE.with_suffix(".json.tmp")
+    with open(tmp_file, "wb") as f:
+        # Compact output serialized in one call, no pretty-printing on the upload/delete path
+        f.write(orjson.dumps(metadata, default=str))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, METADATA_FILE)
+
+
+# Metadata writes are coalesced: handlers only mark the in-memory dict dirty
+# and a background task persists it at most once per FLUSH_INTERVAL_MS
+FLUSH_INTERVAL_MS = 200
+_DIRTY = False
+_FLUSH_TASK: Optional[asyncio.Task] = None
+# Serializes metadata writes: a cancelled flusher can leave a write running
+# in a worker thread while shutdown does its final flush
+_METADATA_IO_LOCK = threading.Lock()
+
+
+def flush_metadata():
+    """Write the metadata file if it has unsaved changes."""
+    global _DIRTY
+    with _METADATA_IO_LOCK:
+        if not _DIRTY:
+            return
+        _DIRTY = False
+        # Copying the dict holds the GIL throughout, so this snapshot is
+        # consistent without taking _METADATA_LOCK for the whole write
+        snapshot = dict(METADATA)
+        save_metadata(snapshot)
+
+
+async def mark_metadata_dirty():
+    """Schedule the in-memory metadata to be written by the background flusher."""
+    global _DIRTY
+    _DIRTY = True
+    if _FLUSH_TASK is None:
+        # No flusher running (app used without startup events): write now
+        await asyncio.to_thread(flush_metadata)
+
+
+async def _flush_loop():
+    """Persist pending metadata changes every FLUSH_INTERVAL_MS."""
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL_MS / 1000)
+        if _DIRTY:
+            await asyncio.to_thread(flush_metadata)
+
+
+async def _stop_flush_loop():
+    """Cancel the background flusher and write any pending changes."""
+    global _FLUSH_TASK
+    if _FLUSH_TASK is not None:
+        _FLUSH_TASK.cancel()
+        try:
+            await _FLUSH_TASK
+        except asyncio.CancelledError:
+            pass
+        _FLUSH_TASK = None
+    flush_metadata()
+
+
+@app.on_event("startup")
+async def startup_event():
+    """Start the background metadata flusher."""
+    global _FLUSH_TASK
+    _FLUSH_TASK = asyncio.create_task(_flush_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush pending metadata changes and close pooled file descriptors before exiting."""
+    await _stop_flush_loop()
+    for stored_filename in list(_FD_POOL):
+        close_pooled_fd(stored_filename)
 
 
 @app.post("/api/files/upload")
 async def upload_file(file: UploadFile = File(...)):
     """Upload a file and store metadata."""
-    # Validate file size
-    contents = await file.read()
-    if len(contents) > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail=f"File size exceeds maximum allowed size of {MAX_FILE_SIZE / (1024*1024)}MB"
-        )
-    
     # Validate file type
-    if not is_allowed_file(file.filename, file.content_type):
+    if not is_allowed_file(file.filename):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="File type not allowed. Only images, PDFs, and text files are permitted."
@@ -117,28 +425,53 @@ async def upload_file(file: UploadFile = File(...)):
     
     # Generate unique file ID and stored filename
     file_id = str(uuid.uuid4())
-    file_ext = Path(sanitized_filename).suffix
+    file_ext = get_extension(sanitized_filename)
     stored_filename = f"{file_id}{file_ext}"
-    file_path = UPLOAD_DIR / stored_filename
+    file_path = _shard_path(stored_filename)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
     
-    # Save file
-    with open(file_path, "wb") as f:
-        f.write(contents)
+    # Starlette has already spooled the upload (to memory or a temp file), so
+    # copy it straight from there in a single worker thread, hashing it on the
+    # way so duplicates can be detected without a second pass. Uploads the
+    # parser already measured as too large are not copied at all.
+    hasher = hashlib.sha256()
+    file_size = file.size or 0
+    if file_size <= MAX_FILE_SIZE:
+        async with _UPLOAD_SEM:
+            file_size = await asyncio.to_thread(write_upload, file.file, file_path, hasher)
+    
+    # Validate file size
+    if file_size > MAX_FILE_SIZE:
+        file_path.unlink(missing_ok=True)
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=FILE_TOO_LARGE_DETAIL
+        )
     
     # Create metadata
     metadata_entry = {
         "id": file_id,
         "original_filename": sanitized_filename,
         "stored_filename": stored_filename,
-        "file_size": len(contents),
-        "mime_type": file.content_type or mimetypes.guess_type(sanitized_filename)[0] or "application/octet-stream",
-        "upload_date": datetime.now().isoformat()
+        "shard_scheme": SHARD_SCHEME,
+        "file_size": file_size,
+        "mime_type": file.content_type or _EXT_TO_MIME.get(file_ext.lower(), "application/octet-stream"),
+        "upload_date": datetime.now().isoformat(),
+        "sha256": hasher.hexdigest()
     }
     
     # Save metadata
-    all_metadata = load_metadata()
-    all_metadata[file_id] = metadata_entry
-    save_metadata(all_metadata)
+    async with _METADATA_LOCK:
+        # Identical content is already stored: point at that file and drop the new copy
+        duplicate = find_duplicate(metadata_entry["sha256"])
+        if duplicate is not None:
+            file_path.unlink(missing_ok=True)
+            metadata_entry["stored_filename"] = duplicate["stored_filename"]
+            metadata_entry["shard_scheme"] = duplicate.get("shard_scheme")
+        _SHA256_INDEX.setdefault(metadata_entry["sha256"], set()).add(file_id)
+        METADATA[file_id] = metadata_entry
+        _BY_DATE.add((metadata_entry["upload_date"], file_id))
+        await mark_metadata_dirty()
     
     return JSONResponse(
         status_code=status.HTTP_201_CREATED,
@@ -147,25 +480,81 @@ async def upload_file(file: UploadFile = File(...)):
 
 
 @app.get("/api/files/")
-async def list_files():
-    """List all uploaded files with metadata."""
-    metadata = load_metadata()
-    return {"files": list(metadata.values())}
+async def list_files(
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size; all files when omitted"),
+    offset: int = Query(0, ge=0),
+    sort: Literal["newest", "oldest"] = "newest"
+):
+    """List uploaded files with metadata, one page at a time."""
+    file_ids = page_by_date(offset, limit, newest_first=sort == "newest")
+    return {
+        "files": [METADATA[i] for i in file_ids if i in METADATA],
+        "total": len(METADATA)
+    }
 
 
 @app.get("/api/files/{file_id}")
-async def download_file(file_id: str):
+async def download_file(file_id: str, request: Request):
     """Download a specific file."""
-    metadata = load_metadata()
-    
-    if file_id not in metadata:
+    if file_id not in METADATA:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="File not found"
         )
     
-    file_info = metadata[file_id]
-    file_path = UPLOAD_DIR / file_info["stored_filename"]
+    file_info = METADATA[file_id]
+    headers = cache_headers(file_info)
+    
+    # Client already has this file cached, skip the disk entirely
+    if is_not_modified(request, headers):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    file_path = stored_file_path(file_info)
+    headers["Content-Disposition"] = content_disposition(file_info["original_filename"])
+    
+    # Behind nginx, hand the download to the proxy so it can sendfile() the
+    # file straight from the page cache
+    if USE_XACCEL:
+        return Response(
+            media_type=file_info["mime_type"],
+            headers={
+                **headers,
+                "X-Accel-Redirect": f"{XACCEL_PREFIX}{file_path.relative_to(UPLOAD_DIR).as_posix()}",
+            }
+        )
+    
+    # Small files: serve from the in-memory cache, reading them once on a miss
+    content = _DOWNLOAD_CACHE.get(file_info["stored_filename"])
+    if content is None and file_info["file_size"] <= DOWNLOAD_CACHE_MAX_FILE_SIZE:
+        try:
+            content = file_path.read_bytes()
+        except FileNotFoundError:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found on disk"
+            )
+        _DOWNLOAD_CACHE[file_info["stored_filename"]] = content
+    if content is not None:
+        return Response(
+            content=content,
+            media_type=file_info["mime_type"],
+            headers=headers
+        )
+    
+    # Larger files: stream from a pooled descriptor, leaving range requests to FileResponse
+    if "range" not in request.headers:
+        try:
+            fd = pooled_fd(file_path, file_info["stored_filename"])
+        except FileNotFoundError:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found on disk"
+            )
+        return StreamingResponse(
+            PooledFileReader(fd, file_info["file_size"]),
+            media_type=file_info["mime_type"],
+            headers={**headers, "Content-Length": str(file_info["file_size"])}
+        )
     
     if not file_path.exists():
         raise HTTPException(
@@ -176,45 +565,50 @@ async def download_file(file_id: str):
     return FileResponse(
         path=file_path,
         filename=file_info["original_filename"],
-        media_type=file_info["mime_type"]
+        media_type=file_info["mime_type"],
+        headers=headers
     )
 
 
 @app.get("/api/files/{file_id}/info")
-async def get_file_info(file_id: str):
+async def get_file_info(file_id: str, request: Request, response: Response):
     """Get file metadata without downloading."""
-    metadata = load_metadata()
-    
-    if file_id not in metadata:
+    if file_id not in METADATA:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="File not found"
         )
     
-    return metadata[file_id]
+    file_info = METADATA[file_id]
+    headers = cache_headers(file_info)
+    if is_not_modified(request, headers):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    response.headers.update(headers)
+    return file_info
 
 
 @app.delete("/api/files/{file_id}")
 async def delete_file(file_id: str):
     """Delete a file and its metadata."""
-    metadata = load_metadata()
-    
-    if file_id not in metadata:
+    if file_id not in METADATA:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="File not found"
         )
     
-    file_info = metadata[file_id]
-    file_path = UPLOAD_DIR / file_info["stored_filename"]
-    
-    # Delete file from filesystem
-    if file_path.exists():
-        file_path.unlink()
-    
-    # Remove from metadata
-    del metadata[file_id]
-    save_metadata(metadata)
+    # Remove from metadata, and from the filesystem unless another entry shares the file
+    async with _METADATA_LOCK:
+        file_info = METADATA.pop(file_id, None)
+        if file_info is not None:
+            _BY_DATE.discard((file_info.get("upload_date", ""), file_id))
+        if file_info is not None and release_stored_file(file_info):
+            file_path = stored_file_path(file_info)
+            if file_path.exists():
+                file_path.unlink()
+            _DOWNLOAD_CACHE.pop(file_info["stored_filename"], None)
+            close_pooled_fd(file_info["stored_filename"])
+        await mark_metadata_dirty()
     
     return {"message": "File deleted successfully", "file_id": file_id}
 
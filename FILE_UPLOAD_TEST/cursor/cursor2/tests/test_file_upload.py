@@ -1,4 +1,5 @@
 import pytest
+import asyncio
 import os
 import sys
 import json
@@ -10,13 +11,36 @@ from pathlib import Path
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
+import httpx
 from fastapi.testclient import TestClient
-from backend.main import app, UPLOAD_DIR, METADATA_FILE, load_metadata
+from sortedcontainers import SortedList
+from backend.main import app, load_metadata, _shard_path, _FD_POOL
 
 # Create a test client
 client = TestClient(app)
 
 # Test fixtures
+@pytest.fixture(autouse=True)
+def upload_dir(tmp_path, monkeypatch):
+    """Point the app at an empty upload directory for each test."""
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    monkeypatch.setattr("backend.main.UPLOAD_DIR", upload_dir)
+    return upload_dir
+
+
+@pytest.fixture(autouse=True)
+def metadata_file(tmp_path, monkeypatch):
+    """Point the app at an empty metadata file and in-memory state for each test."""
+    metadata_file = tmp_path / "metadata.json"
+    metadata_file.write_text("{}")
+    monkeypatch.setattr("backend.main.METADATA_FILE", metadata_file)
+    monkeypatch.setattr("backend.main.METADATA", {})
+    monkeypatch.setattr("backend.main._SHA256_INDEX", {})
+    monkeypatch.setattr("backend.main._BY_DATE", SortedList())
+    return metadata_file
+
+
 @pytest.fixture
 def sample_image_file():
     """Create a sample image file for testing."""
@@ -69,17 +93,8 @@ class TestFileUpload:
         assert "stored_filename" in data
         
         # Verify file exists on disk
-        stored_path = UPLOAD_DIR / data["stored_filename"]
+        stored_path = _shard_path(data["stored_filename"])
         assert stored_path.exists()
-        
-        # Cleanup
-        if stored_path.exists():
-            stored_path.unlink()
-        metadata = load_metadata()
-        if data["id"] in metadata:
-            del metadata[data["id"]]
-            with open(METADATA_FILE, "w") as f:
-                json.dump(metadata, f)
     
     def test_upload_valid_text_file(self, sample_text_file):
         """Test uploading a valid text file."""
@@ -94,16 +109,6 @@ class TestFileUpload:
         data = response.json()
         assert data["original_filename"] == filename
         assert data["file_size"] == len(content)
-        
-        # Cleanup
-        stored_path = UPLOAD_DIR / data["stored_filename"]
-        if stored_path.exists():
-            stored_path.unlink()
-        metadata = load_metadata()
-        if data["id"] in metadata:
-            del metadata[data["id"]]
-            with open(METADATA_FILE, "w") as f:
-                json.dump(metadata, f)
     
     def test_upload_valid_pdf(self, sample_pdf_file):
         """Test uploading a valid PDF file."""
@@ -117,16 +122,6 @@ class TestFileUpload:
         assert response.status_code == 201
         data = response.json()
         assert data["original_filename"] == filename
-        
-        # Cleanup
-        stored_path = UPLOAD_DIR / data["stored_filename"]
-        if stored_path.exists():
-            stored_path.unlink()
-        metadata = load_metadata()
-        if data["id"] in metadata:
-            del metadata[data["id"]]
-            with open(METADATA_FILE, "w") as f:
-                json.dump(metadata, f)
     
     def test_upload_invalid_file_type(self, sample_invalid_file):
         """Test that invalid file types are rejected."""
@@ -140,18 +135,46 @@ class TestFileUpload:
         assert response.status_code == 400
         assert "not allowed" in response.json()["detail"].lower()
     
-    def test_upload_file_too_large(self):
-        """Test that files exceeding 10MB are rejected."""
-        # Create a file larger than 10MB
-        large_content = b"x" * (11 * 1024 * 1024)  # 11MB
-        
+    def test_upload_disallowed_extension_with_allowed_mime_type(self):
+        """Test that the extension decides, whatever MIME type the client declares."""
         response = client.post(
             "/api/files/upload",
-            files={"file": ("large.txt", large_content, "text/plain")}
+            files={"file": ("script.exe", b"MZ\x90\x00", "text/plain")}
         )
         
+        assert response.status_code == 400
+        assert "not allowed" in response.json()["detail"].lower()
+    
+    def test_upload_file_too_large(self, upload_dir):
+        """Test that files exceeding 10MB are rejected before their body is read."""
+        chunks_sent = 0
+        
+        async def large_body():
+            nonlocal chunks_sent
+            for _ in range(11):
+                chunks_sent += 1
+                yield b"x" * (1024 * 1024)
+        
+        async def post_large_body():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+                return await async_client.post(
+                    "/api/files/upload",
+                    content=large_body(),
+                    headers={
+                        "Content-Type": "multipart/form-data; boundary=boundary",
+                        "Content-Length": str(11 * 1024 * 1024)
+                    }
+                )
+        
+        response = asyncio.run(post_large_body())
+        
         assert response.status_code == 413
         assert "exceeds" in response.json()["detail"].lower()
+        
+        # Rejected from Content-Length alone: none of the 11MB was read or stored
+        assert chunks_sent == 0
+        assert not list(upload_dir.rglob("*.txt"))
 
 
 class TestFileListing:
@@ -159,10 +182,6 @@ class TestFileListing:
     
     def test_list_files_empty(self):
         """Test listing files when no files are uploaded."""
-        # Clear metadata
-        with open(METADATA_FILE, "w") as f:
-            json.dump({}, f)
-        
         response = client.get("/api/files/")
         assert response.status_code == 200
         data = response.json()
@@ -187,16 +206,38 @@ class TestFileListing:
         data = response.json()
         assert len(data["files"]) > 0
         assert any(f["id"] == uploaded_file_id for f in data["files"])
+    
+    def test_list_files_paginated(self, sample_text_file):
+        """Test limit/offset/sort on the file listing."""
+        _, _, mime_type = sample_text_file
+        file_ids = []
+        for i in range(3):
+            response = client.post(
+                "/api/files/upload",
+                files={"file": (f"page{i}.txt", f"page {i}".encode(), mime_type)}
+            )
+            file_ids.append(response.json()["id"])
         
-        # Cleanup
-        stored_path = UPLOAD_DIR / upload_response.json()["stored_filename"]
-        if stored_path.exists():
-            stored_path.unlink()
-        metadata = load_metadata()
-        if uploaded_file_id in metadata:
-            del metadata[uploaded_file_id]
-            with open(METADATA_FILE, "w") as f:
-                json.dump(metadata, f)
+        newest = client.get("/api/files/", params={"limit": 2}).json()
+        assert [f["id"] for f in newest["files"]] == [file_ids[2], file_ids[1]]
+        assert newest["total"] == 3
+        
+        second = client.get("/api/files/", params={"limit": 1, "offset": 1}).json()
+        assert [f["id"] for f in second["files"]] == [file_ids[1]]
+        
+        oldest = client.get("/api/files/", params={"limit": 1000, "sort": "oldest"}).json()
+        assert [f["id"] for f in oldest["files"]] == file_ids
+        
+        assert client.get("/api/files/", params={"limit": 0}).status_code == 422
+    
+    def test_list_files_unpaged_returns_all(self, sample_text_file):
+        """Test that the listing returns every file when no limit is given."""
+        _, _, mime_type = sample_text_file
+        for i in range(51):
+            client.post("/api/files/upload", files={"file": (f"all{i}.txt", f"all {i}".encode(), mime_type)})
+        
+        data = client.get("/api/files/").json()
+        assert len(data["files"]) == data["total"] == 51
 
 
 class TestFileDownload:
@@ -218,16 +259,81 @@ class TestFileDownload:
         response = client.get(f"/api/files/{file_id}")
         assert response.status_code == 200
         assert response.content == content
+    
+    def test_download_large_file_from_fd_pool(self):
+        """Test that larger files are streamed from a pooled descriptor closed on delete."""
+        content = os.urandom(512 * 1024)
         
-        # Cleanup
-        stored_path = UPLOAD_DIR / upload_response.json()["stored_filename"]
-        if stored_path.exists():
-            stored_path.unlink()
-        metadata = load_metadata()
-        if file_id in metadata:
-            del metadata[file_id]
-            with open(METADATA_FILE, "w") as f:
-                json.dump(metadata, f)
+        upload_response = client.post(
+            "/api/files/upload",
+            files={"file": ("large.pdf", content, "application/pdf")}
+        )
+        file_id = upload_response.json()["id"]
+        stored_filename = upload_response.json()["stored_filename"]
+        
+        for _ in range(2):
+            response = client.get(f"/api/files/{file_id}")
+            assert response.status_code == 200
+            assert response.content == content
+            assert response.headers["content-length"] == str(len(content))
+        assert stored_filename in _FD_POOL
+        
+        # Range requests are still served by FileResponse
+        response = client.get(f"/api/files/{file_id}", headers={"Range": "bytes=0-9"})
+        assert response.status_code == 206
+        assert response.content == content[:10]
+        
+        client.delete(f"/api/files/{file_id}")
+        assert stored_filename not in _FD_POOL
+    
+    def test_download_via_xaccel(self, sample_text_file, monkeypatch):
+        """Test that downloads are handed to nginx when X-Accel-Redirect is enabled."""
+        filename, content, mime_type = sample_text_file
+        monkeypatch.setattr("backend.main.USE_XACCEL", True)
+        
+        upload_response = client.post(
+            "/api/files/upload",
+            files={"file": (filename, content, mime_type)}
+        )
+        file_id = upload_response.json()["id"]
+        stored_filename = upload_response.json()["stored_filename"]
+        
+        response = client.get(f"/api/files/{file_id}")
+        assert response.status_code == 200
+        assert response.headers["x-accel-redirect"] == (
+            f"/_protected_uploads/{stored_filename[:2]}/{stored_filename[2:4]}/{stored_filename}"
+        )
+        assert filename in response.headers["content-disposition"]
+        assert response.content == b""
+    
+    def test_conditional_download(self, sample_text_file):
+        """Test ETag/Last-Modified headers and 304 responses for download and info."""
+        filename, content, mime_type = sample_text_file
+        
+        upload_response = client.post(
+            "/api/files/upload",
+            files={"file": (filename, content, mime_type)}
+        )
+        file_id = upload_response.json()["id"]
+        
+        for url in (f"/api/files/{file_id}", f"/api/files/{file_id}/info"):
+            response = client.get(url)
+            assert response.status_code == 200
+            etag = response.headers["etag"]
+            last_modified = response.headers["last-modified"]
+            assert upload_response.json()["stored_filename"] in etag
+            assert response.headers["cache-control"] == "private, max-age=3600"
+            
+            # Matching validators return an empty 304
+            cached = client.get(url, headers={"If-None-Match": etag})
+            assert cached.status_code == 304
+            assert cached.content == b""
+            cached = client.get(url, headers={"If-Modified-Since": last_modified})
+            assert cached.status_code == 304
+            
+            # A non-matching ETag returns the full response
+            stale = client.get(url, headers={"If-None-Match": '"other"'})
+            assert stale.status_code == 200
     
     def test_download_nonexistent_file(self):
         """Test downloading a file that doesn't exist."""
@@ -253,7 +359,7 @@ class TestFileDeletion:
         stored_filename = upload_response.json()["stored_filename"]
         
         # Verify file exists
-        stored_path = UPLOAD_DIR / stored_filename
+        stored_path = _shard_path(stored_filename)
         assert stored_path.exists()
         
         # Delete the file
@@ -268,6 +374,32 @@ class TestFileDeletion:
         metadata = load_metadata()
         assert file_id not in metadata
     
+    def test_delete_duplicate_keeps_shared_file(self, sample_text_file):
+        """Test that identical uploads share one stored file until the last is deleted."""
+        _, content, mime_type = sample_text_file
+        
+        first = client.post(
+            "/api/files/upload",
+            files={"file": ("first.txt", content, mime_type)}
+        ).json()
+        second = client.post(
+            "/api/files/upload",
+            files={"file": ("second.txt", content, mime_type)}
+        ).json()
+        assert first["id"] != second["id"]
+        assert first["stored_filename"] == second["stored_filename"]
+        stored_path = _shard_path(first["stored_filename"])
+        
+        # Deleting one entry keeps the file for the other
+        client.delete(f"/api/files/{first['id']}")
+        assert stored_path.exists()
+        response = client.get(f"/api/files/{second['id']}")
+        assert response.content == content
+        
+        # Deleting the last entry removes the file
+        client.delete(f"/api/files/{second['id']}")
+        assert not stored_path.exists()
+    
     def test_delete_nonexistent_file(self):
         """Test deleting a file that doesn't exist."""
         fake_id = "00000000-0000-0000-0000-000000000000"
@@ -298,16 +430,6 @@ class TestFileInfo:
         assert data["original_filename"] == filename
         assert data["file_size"] == len(content)
         assert "upload_date" in data
-        
-        # Cleanup
-        stored_path = UPLOAD_DIR / upload_response.json()["stored_filename"]
-        if stored_path.exists():
-            stored_path.unlink()
-        metadata = load_metadata()
-        if file_id in metadata:
-            del metadata[file_id]
-            with open(METADATA_FILE, "w") as f:
-                json.dump(metadata, f)
     
     def test_get_info_nonexistent_file(self):
         """Test getting info for a file that doesn't exist."""
@@ -316,3 +438,38 @@ class TestFileInfo:
         assert response.status_code == 404
 
 
+class TestMetadataPersistence:
+    """Test batched metadata writes."""
+    
+    def test_metadata_flushed_on_shutdown(self, sample_text_file, metadata_file):
+        """Test that pending metadata changes are written when the app shuts down."""
+        filename, content, mime_type = sample_text_file
+        
+        with TestClient(app) as lifespan_client:
+            response = lifespan_client.post(
+                "/api/files/upload",
+                files={"file": (filename, content, mime_type)}
+            )
+            assert response.status_code == 201
+            file_id = response.json()["id"]
+        
+        with open(metadata_file, "r") as f:
+            assert file_id in json.load(f)
+    
+    def test_concurrent_flushes(self, sample_text_file, metadata_file):
+        """Test that overlapping flushes (e.g. a cancelled flusher and the shutdown flush) don't collide."""
+        from concurrent.futures import ThreadPoolExecutor
+        import backend.main
+        filename, content, mime_type = sample_text_file
+        file_id = client.post("/api/files/upload", files={"file": (filename, content, mime_type)}).json()["id"]
+        
+        def dirty_flush():
+            backend.main._DIRTY = True
+            backend.main.flush_metadata()
+        
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            for future in [pool.submit(dirty_flush) for _ in range(64)]:
+                future.result()
+        
+        with open(metadata_file, "r") as f:
+            assert file_id in json.load(f)
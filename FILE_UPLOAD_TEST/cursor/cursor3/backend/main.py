@@ -1,17 +1,49 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Path
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Path, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers
 import os
-import json
+import orjson
 import uuid
-from datetime import datetime
+import hashlib
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path as PathLib
-from typing import Optional
-import mimetypes
+from typing import Literal, Optional
 import re
+from urllib.parse import quote
+import asyncio
+import threading
+import weakref
+from cachetools import LRUCache
+from sortedcontainers import SortedList
 
 app = FastAPI(title="File Upload & Management API")
 
+
+class UploadSizeLimitMiddleware:
+    """Reject uploads whose declared Content-Length is too large before the body is read"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/api/files/upload":
+            try:
+                declared = int(Headers(scope=scope).get("content-length", 0))
+            except ValueError:
+                declared = 0
+            if declared > MAX_REQUEST_SIZE:
+                response = JSONResponse(status_code=400, content={"detail": FILE_TOO_LARGE_DETAIL})
+                await response(scope, receive, send)
+                return
+        # Chunked uploads without Content-Length are still limited while streaming
+        await self.app(scope, receive, send)
+
+
+# Registered before CORS so CORS headers are still added to its responses
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # CORS middleware to allow frontend requests
 app.add_middleware(
     CORSMiddleware,
@@ -27,39 +59,312 @@ BACKEND_DIR = PathLib(__file__).parent
 UPLOAD_DIR = BACKEND_DIR / "uploads"
 METADATA_FILE = BACKEND_DIR / "metadata.json"
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+# Headroom for the multipart boundaries and part headers around the file
+MAX_REQUEST_SIZE = MAX_FILE_SIZE + 64 * 1024
+FILE_TOO_LARGE_DETAIL = f"File size exceeds maximum allowed size of {MAX_FILE_SIZE / (1024*1024)}MB"
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB chunks when copying uploads to disk
+
+# Stored files are sharded into two levels of subdirectories by the first
+# four hex characters of their UUID, keeping directory sizes bounded. The
+# scheme version is recorded per entry to allow future migrations.
+SHARD_SCHEME = 1
+
+# Stored files never change after upload, but browsers revalidate after an
+# hour so deleted files stop being served from their cache
+CACHE_CONTROL = "private, max-age=3600"
+
+# Serve downloads via nginx X-Accel-Redirect instead of streaming them from Python.
+# Requires an internal nginx location mapping XACCEL_PREFIX to the uploads dir:
+#   location /_protected_uploads/ { internal; alias /path/to/uploads/; }
+USE_XACCEL = os.getenv("USE_XACCEL", "").lower() in ("1", "true", "yes")
+XACCEL_PREFIX = os.getenv("XACCEL_PREFIX", "/_protected_uploads/")
+
+# At most this many uploads are copied to disk at once; the rest wait their
+# turn so bursts don't compete for disk bandwidth and worker threads
+MAX_CONCURRENT_UPLOADS = int(os.getenv("MAX_CONCURRENT_UPLOADS", "8"))
+_UPLOAD_SEM = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+
+# Small files are kept in an in-memory LRU (keyed by stored filename, so
+# deduplicated uploads share an entry) to serve repeat downloads from RAM
+DOWNLOAD_CACHE_MAX_FILE_SIZE = 256 * 1024  # 256KB
+DOWNLOAD_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 64MB total
+_DOWNLOAD_CACHE = LRUCache(maxsize=DOWNLOAD_CACHE_MAX_BYTES, getsizeof=len)
+
+
+class _FdPool(LRUCache):
+    """LRU of read-only file descriptors that closes them when they are evicted"""
+    
+    def popitem(self):
+        key, fd = super().popitem()
+        os.close(fd)
+        return key, fd
+
+
+# Larger files are streamed from pooled descriptors (keyed by stored filename)
+# so repeated downloads skip the path lookup and open() of the same file
+FD_POOL_SIZE = 128
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+_FD_POOL = _FdPool(maxsize=FD_POOL_SIZE)
 
 # Allowed file types
-ALLOWED_MIME_TYPES = {
+ALLOWED_MIME_TYPES = frozenset({
     "image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp",
     "application/pdf",
     "text/plain", "text/html", "text/css", "text/javascript", "text/csv",
     "application/json", "text/xml"
-}
+})
 
-ALLOWED_EXTENSIONS = {
+ALLOWED_EXTENSIONS = frozenset({
     ".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp",
     ".pdf",
     ".txt", ".html", ".css", ".js", ".csv", ".json", ".xml"
+})
+
+# MIME type for each allowed extension, so uploads don't go through the
+# mimetypes module and the system mime.types database
+_EXT_TO_MIME = {
+    ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png",
+    ".gif": "image/gif", ".webp": "image/webp", ".bmp": "image/bmp",
+    ".pdf": "application/pdf",
+    ".txt": "text/plain", ".html": "text/html", ".css": "text/css",
+    ".js": "text/javascript", ".csv": "text/csv",
+    ".json": "application/json", ".xml": "text/xml"
 }
 
+# Characters replaced in uploaded filenames (compiled once at import)
+_SANITIZE_RE = re.compile(r'[<>:"/\\|?*]')
+
 
 def ensure_directories():
     """Ensure upload directory exists"""
     UPLOAD_DIR.mkdir(exist_ok=True)
 
 
-def load_metadata() -> dict:
-    """Load metadata from JSON file"""
+def read_metadata_file() -> dict:
+    """Read metadata from JSON file"""
     if METADATA_FILE.exists():
-        with open(METADATA_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return orjson.loads(METADATA_FILE.read_bytes())
     return {}
 
 
+# Authoritative metadata, loaded once at import and mutated in place by the
+# handlers; METADATA_FILE is only written to persist it
+METADATA: dict = read_metadata_file()
+_METADATA_LOCK = asyncio.Lock()
+
+
+def _build_sha256_index() -> dict:
+    """Map each content hash to the IDs of the entries that have that content"""
+    index = {}
+    for entry in METADATA.values():
+        if "sha256" in entry:
+            index.setdefault(entry["sha256"], set()).add(entry["id"])
+    return index
+
+
+# Content hash -> file IDs, used to store identical uploads only once
+_SHA256_INDEX: dict = _build_sha256_index()
+
+
+def find_duplicate(digest: str) -> Optional[dict]:
+    """Return an existing entry whose stored file has the given content hash"""
+    for other_id in _SHA256_INDEX.get(digest, ()):
+        entry = METADATA.get(other_id)
+        if entry is not None and entry.get("sha256") == digest:
+            return entry
+    return None
+
+
+def release_stored_file(entry: dict) -> bool:
+    """Unregister an entry from the hash index; return True if its stored file is no longer used"""
+    file_ids = _SHA256_INDEX.get(entry.get("sha256"))
+    if file_ids is None:
+        return True
+    file_ids.discard(entry["id"])
+    # Drop IDs whose entries are gone, then see if anyone else shares the file
+    file_ids.intersection_update(METADATA)
+    if not file_ids:
+        del _SHA256_INDEX[entry["sha256"]]
+    return not any(METADATA[i]["stored_filename"] == entry["stored_filename"] for i in file_ids)
+
+
+# (upload_date, file_id) pairs kept in sorted order, so listings are sliced
+# instead of re-sorted on every request
+_BY_DATE = SortedList((entry.get("upload_date", ""), entry["id"]) for entry in METADATA.values())
+
+
+def page_by_date(offset: int, limit: Optional[int], newest_first: bool) -> list:
+    """Return one page of file IDs ordered by upload date (all of them without a limit)"""
+    if limit is None:
+        limit = len(_BY_DATE)
+    if newest_first:
+        end = len(_BY_DATE) - offset
+        page = _BY_DATE.islice(max(end - limit, 0), max(end, 0), reverse=True)
+    else:
+        page = _BY_DATE.islice(offset, offset + limit)
+    return [file_id for _, file_id in page]
+
+
+def load_metadata() -> dict:
+    """Return the in-memory metadata"""
+    return METADATA
+
+
+def _private_opener(path, flags):
+    """Opener creating uploaded files readable only by the server process"""
+    return os.open(path, flags, 0o600)
+
+
+def write_upload(source, file_path: PathLib, hasher) -> int:
+    """Copy an upload's spooled file to disk, hashing it; return the bytes read (stops past MAX_FILE_SIZE)"""
+    size = 0
+    with open(file_path, "xb", opener=_private_opener) as dst:
+        while chunk := source.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > MAX_FILE_SIZE:
+                break
+            hasher.update(chunk)
+            dst.write(chunk)
+    return size
+
+
+def pooled_fd(file_path: PathLib, stored_filename: str) -> int:
+    """Return a pooled read-only descriptor for a stored file, opening it on a miss"""
+    fd = _FD_POOL.get(stored_filename)
+    if fd is None:
+        fd = os.open(file_path, os.O_RDONLY | os.O_CLOEXEC)
+        _FD_POOL[stored_filename] = fd
+    return fd
+
+
+def close_pooled_fd(stored_filename: str):
+    """Drop a stored file's descriptor from the pool and close it"""
+    fd = _FD_POOL.pop(stored_filename, None)
+    if fd is not None:
+        os.close(fd)
+
+
+class PooledFileReader:
+    """Async iterator over a file read with pread() from a private duplicate of a pooled descriptor"""
+    
+    def __init__(self, fd: int, size: int):
+        # The duplicate stays valid even if the pooled descriptor is evicted
+        # or closed mid-download, and is closed once the reader is done or dropped
+        self.fd = os.dup(fd)
+        self.size = size
+        self._close = weakref.finalize(self, os.close, self.fd)
+    
+    async def __aiter__(self):
+        try:
+            offset = 0
+            while offset < self.size:
+                chunk = await asyncio.to_thread(os.pread, self.fd, DOWNLOAD_CHUNK_SIZE, offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                yield chunk
+        finally:
+            self._close()
+
+
+def cache_headers(entry: dict) -> dict:
+    """Build the validator and caching headers for a stored file"""
+    uploaded = datetime.fromisoformat(entry["upload_date"]).replace(tzinfo=timezone.utc)
+    return {
+        "ETag": f'"{entry["stored_filename"]}"',
+        "Last-Modified": formatdate(uploaded.timestamp(), usegmt=True),
+        "Cache-Control": CACHE_CONTROL,
+    }
+
+
+def is_not_modified(request: Request, headers: dict) -> bool:
+    """Check the request's If-None-Match / If-Modified-Since against a file's validators"""
+    # If-None-Match takes precedence; If-Modified-Since is only used without it
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return if_none_match.strip() == "*" or headers["ETag"] in (tag.strip() for tag in if_none_match.split(","))
+    if_modified_since = request.headers.get("if-modified-since")
+    if not if_modified_since:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return parsedate_to_datetime(headers["Last-Modified"]) <= since
+
+
+def content_disposition(filename: str) -> str:
+    """Build an attachment Content-Disposition header for the given filename"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
 def save_metadata(metadata: dict):
-    """Save metadata to JSON file"""
-    with open(METADATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    """Save metadata to JSON file atomically (write a temp file, then replace)"""
+    tmp_file = METADATA_FILE.with_suffix(".json.tmp")
+    with open(tmp_file, "wb") as f:
+        # Compact UTF-8 output serialized in one call, no pretty-printing on the upload/delete path
+        f.write(orjson.dumps(metadata))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, METADATA_FILE)
+
+
+# Metadata writes are coalesced: handlers only mark the in-memory dict dirty
+# and a background task persists it at most once per FLUSH_INTERVAL_MS
+FLUSH_INTERVAL_MS = 200
+_DIRTY = False
+_FLUSH_TASK: Optional[asyncio.Task] = None
+# Serializes metadata writes: a cancelled flusher can leave a write running
+# in a worker thread while shutdown does its final flush
+_METADATA_IO_LOCK = threading.Lock()
+
+
+def flush_metadata():
+    """Write the metadata file if it has unsaved changes"""
+    global _DIRTY
+    with _METADATA_IO_LOCK:
+        if not _DIRTY:
+            return
+        _DIRTY = False
+        # Copying the dict holds the GIL throughout, so this snapshot is
+        # consistent without taking _METADATA_LOCK for the whole write
+        snapshot = dict(METADATA)
+        save_metadata(snapshot)
+
+
+async def mark_metadata_dirty():
+    """Schedule the in-memory metadata to be written by the background flusher"""
+    global _DIRTY
+    _DIRTY = True
+    if _FLUSH_TASK is None:
+        # No flusher running (app used without startup events): write now
+        await asyncio.to_thread(flush_metadata)
+
+
+async def _flush_loop():
+    """Persist pending metadata changes every FLUSH_INTERVAL_MS"""
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL_MS / 1000)
+        if _DIRTY:
+            await asyncio.to_thread(flush_metadata)
+
+
+async def _stop_flush_loop():
+    """Cancel the background flusher and write any pending changes"""
+    global _FLUSH_TASK
+    if _FLUSH_TASK is not None:
+        _FLUSH_TASK.cancel()
+        try:
+            await _FLUSH_TASK
+        except asyncio.CancelledError:
+            pass
+        _FLUSH_TASK = None
+    flush_metadata()
 
 
 def sanitize_filename(filename: str) -> str:
@@ -67,7 +372,7 @@ def sanitize_filename(filename: str) -> str:
     # Remove path components
     filename = os.path.basename(filename)
     # Remove or replace dangerous characters
-    filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
+    filename = _SANITIZE_RE.sub('_', filename)
     # Remove leading/trailing dots and spaces
     filename = filename.strip('. ')
     # Ensure filename is not empty
@@ -76,11 +381,31 @@ def sanitize_filename(filename: str) -> str:
     return filename
 
 
+def _shard_path(stored_filename: str) -> PathLib:
+    """Return the sharded location of a stored file: uploads/ab/cd/abcd...ext"""
+    return UPLOAD_DIR / stored_filename[:2] / stored_filename[2:4] / stored_filename
+
+
+def stored_file_path(entry: dict) -> PathLib:
+    """Return where an entry's file is stored (flat for entries from before sharding)"""
+    if entry.get("shard_scheme") == SHARD_SCHEME:
+        return _shard_path(entry["stored_filename"])
+    return UPLOAD_DIR / entry["stored_filename"]
+
+
+def get_extension(filename: str) -> str:
+    """Return the file extension including the dot, like Path(filename).suffix"""
+    # String ops only, no PurePath object per call; dotfiles and names
+    # ending in a dot have no extension
+    stem, dot, ext = filename.rpartition("/")[2].rpartition(".")
+    return dot + ext if stem and ext else ""
+
+
 def validate_file_type(file: UploadFile) -> bool:
     """Validate that file type is allowed"""
     # Check extension
     original_filename = file.filename or ""
-    ext = PathLib(original_filename).suffix.lower()
+    ext = get_extension(original_filename).lower()
     if ext not in ALLOWED_EXTENSIONS:
         return False
     
@@ -94,14 +419,23 @@ def validate_file_type(file: UploadFile) -> bool:
 
 def get_file_metadata(file_id: str) -> Optional[dict]:
     """Get metadata for a specific file"""
-    metadata = load_metadata()
-    return metadata.get(file_id)
+    return METADATA.get(file_id)
 
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize directories on startup"""
+    """Initialize directories and the metadata flusher on startup"""
+    global _FLUSH_TASK
     ensure_directories()
+    _FLUSH_TASK = asyncio.create_task(_flush_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush pending metadata changes and close pooled file descriptors on shutdown"""
+    await _stop_flush_loop()
+    for stored_filename in list(_FD_POOL):
+        close_pooled_fd(stored_filename)
 
 
 @app.post("/api/files/upload")
@@ -114,87 +448,154 @@ async def upload_file(file: UploadFile = File(...)):
             detail="File type not allowed. Only images, PDFs, and text files are permitted."
         )
     
-    # Read file content
-    content = await file.read()
-    
-    # Check file size
-    if len(content) > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=400,
-            detail=f"File size exceeds maximum allowed size of {MAX_FILE_SIZE / (1024*1024)}MB"
-        )
-    
     # Sanitize filename
     original_filename = sanitize_filename(file.filename or "unnamed_file")
     
     # Generate unique file ID and stored filename
     file_id = str(uuid.uuid4())
-    ext = PathLib(original_filename).suffix
+    ext = get_extension(original_filename)
     stored_filename = f"{file_id}{ext}"
-    stored_path = UPLOAD_DIR / stored_filename
+    stored_path = _shard_path(stored_filename)
+    stored_path.parent.mkdir(parents=True, exist_ok=True)
     
-    # Save file
-    with open(stored_path, "wb") as f:
-        f.write(content)
+    # Copy straight from the file Starlette already spooled the upload to, in a
+    # single worker thread instead of one thread hop per chunk; hash it on the
+    # way so duplicates can be detected without reading the file back. Skip the
+    # copy when the parser already measured the upload as too large.
+    hasher = hashlib.sha256()
+    file_size = file.size or 0
+    if file_size <= MAX_FILE_SIZE:
+        async with _UPLOAD_SEM:
+            file_size = await asyncio.to_thread(write_upload, file.file, stored_path, hasher)
+    
+    # Check file size
+    if file_size > MAX_FILE_SIZE:
+        stored_path.unlink(missing_ok=True)
+        raise HTTPException(
+            status_code=400,
+            detail=FILE_TOO_LARGE_DETAIL
+        )
     
     # Determine MIME type
-    mime_type, _ = mimetypes.guess_type(original_filename)
-    if not mime_type:
-        mime_type = file.content_type or "application/octet-stream"
+    mime_type = _EXT_TO_MIME.get(ext.lower()) or file.content_type or "application/octet-stream"
     
     # Create metadata
     file_metadata = {
         "id": file_id,
         "original_filename": original_filename,
         "stored_filename": stored_filename,
-        "file_size": len(content),
+        "shard_scheme": SHARD_SCHEME,
+        "file_size": file_size,
         "mime_type": mime_type,
-        "upload_date": datetime.utcnow().isoformat()
+        "upload_date": datetime.utcnow().isoformat(),
+        "sha256": hasher.hexdigest()
     }
     
     # Save metadata
-    metadata = load_metadata()
-    metadata[file_id] = file_metadata
-    save_metadata(metadata)
+    async with _METADATA_LOCK:
+        # Identical content is already stored: reuse that file and drop the new copy
+        duplicate = find_duplicate(file_metadata["sha256"])
+        if duplicate is not None:
+            stored_path.unlink(missing_ok=True)
+            file_metadata["stored_filename"] = duplicate["stored_filename"]
+            file_metadata["shard_scheme"] = duplicate.get("shard_scheme")
+        _SHA256_INDEX.setdefault(file_metadata["sha256"], set()).add(file_id)
+        METADATA[file_id] = file_metadata
+        _BY_DATE.add((file_metadata["upload_date"], file_id))
+        await mark_metadata_dirty()
     
     return JSONResponse(content=file_metadata, status_code=201)
 
 
 @app.get("/api/files/")
-async def list_files():
-    """List all uploaded files with metadata"""
-    metadata = load_metadata()
-    files_list = list(metadata.values())
-    # Sort by upload date (newest first)
-    files_list.sort(key=lambda x: x.get("upload_date", ""), reverse=True)
-    return {"files": files_list, "count": len(files_list)}
+async def list_files(
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size; all files when omitted"),
+    offset: int = Query(0, ge=0),
+    sort: Literal["newest", "oldest"] = "newest"
+):
+    """List uploaded files with metadata, newest first unless sort=oldest"""
+    file_ids = page_by_date(offset, limit, newest_first=sort == "newest")
+    files_list = [METADATA[i] for i in file_ids if i in METADATA]
+    return {"files": files_list, "count": len(files_list), "total": len(METADATA)}
 
 
 @app.get("/api/files/{file_id}")
-async def download_file(file_id: str = Path(..., description="File ID")):
+async def download_file(request: Request, file_id: str = Path(..., description="File ID")):
     """Download a specific file"""
     file_metadata = get_file_metadata(file_id)
     if not file_metadata:
         raise HTTPException(status_code=404, detail="File not found")
     
-    stored_path = UPLOAD_DIR / file_metadata["stored_filename"]
+    headers = cache_headers(file_metadata)
+    
+    # Client already has this file cached, skip the disk entirely
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    
+    stored_path = stored_file_path(file_metadata)
+    headers["Content-Disposition"] = content_disposition(file_metadata["original_filename"])
+    
+    # Behind nginx, hand the download to the proxy so it can sendfile() the
+    # file straight from the page cache
+    if USE_XACCEL:
+        return Response(
+            media_type=file_metadata["mime_type"],
+            headers={
+                **headers,
+                "X-Accel-Redirect": f"{XACCEL_PREFIX}{stored_path.relative_to(UPLOAD_DIR).as_posix()}",
+            }
+        )
+    
+    # Small files: serve from the in-memory cache, reading them once on a miss
+    content = _DOWNLOAD_CACHE.get(file_metadata["stored_filename"])
+    if content is None and file_metadata["file_size"] <= DOWNLOAD_CACHE_MAX_FILE_SIZE:
+        try:
+            content = stored_path.read_bytes()
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found on disk")
+        _DOWNLOAD_CACHE[file_metadata["stored_filename"]] = content
+    if content is not None:
+        return Response(
+            content=content,
+            media_type=file_metadata["mime_type"],
+            headers=headers
+        )
+    
+    # Larger files: stream from a pooled descriptor, leaving range requests to FileResponse
+    if "range" not in request.headers:
+        try:
+            fd = pooled_fd(stored_path, file_metadata["stored_filename"])
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found on disk")
+        return StreamingResponse(
+            PooledFileReader(fd, file_metadata["file_size"]),
+            media_type=file_metadata["mime_type"],
+            headers={**headers, "Content-Length": str(file_metadata["file_size"])}
+        )
+    
     if not stored_path.exists():
         raise HTTPException(status_code=404, detail="File not found on disk")
     
     return FileResponse(
         path=stored_path,
         filename=file_metadata["original_filename"],
-        media_type=file_metadata["mime_type"]
+        media_type=file_metadata["mime_type"],
+        headers=headers
     )
 
 
 @app.get("/api/files/{file_id}/info")
-async def get_file_info(file_id: str = Path(..., description="File ID")):
+async def get_file_info(request: Request, response: Response, file_id: str = Path(..., description="File ID")):
     """Get file metadata without downloading"""
     file_metadata = get_file_metadata(file_id)
     if not file_metadata:
         raise HTTPException(status_code=404, detail="File not found")
     
+    headers = cache_headers(file_metadata)
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    
+    response.headers.update(headers)
     return file_metadata
 
 
@@ -205,16 +606,18 @@ async def delete_file(file_id: str = Path(..., description="File ID")):
     if not file_metadata:
         raise HTTPException(status_code=404, detail="File not found")
     
-    # Delete file from disk
-    stored_path = UPLOAD_DIR / file_metadata["stored_filename"]
-    if stored_path.exists():
-        stored_path.unlink()
-    
-    # Remove from metadata
-    metadata = load_metadata()
-    if file_id in metadata:
-        del metadata[file_id]
-        save_metadata(metadata)
+    # Remove from metadata, and delete from disk unless another entry shares the file
+    async with _METADATA_LOCK:
+        file_metadata = METADATA.pop(file_id, None)
+        if file_metadata is not None:
+            _BY_DATE.discard((file_metadata.get("upload_date", ""), file_id))
+            if release_stored_file(file_metadata):
+                stored_path = stored_file_path(file_metadata)
+                if stored_path.exists():
+                    stored_path.unlink()
+                _DOWNLOAD_CACHE.pop(file_metadata["stored_filename"], None)
+                close_pooled_fd(file_metadata["stored_filename"])
+            await mark_metadata_dirty()
     
     return {"message": "File deleted successfully", "file_id": file_id}
 
@@ -1,10 +1,14 @@
 import pytest
 import os
 import json
-import shutil
 from pathlib import Path
 import asyncio
-from backend.main import app, UPLOAD_DIR, METADATA_FILE
+from sortedcontainers import SortedList
+import backend.main
+from backend.main import (
+    app, _DOWNLOAD_CACHE, _FD_POOL, _shard_path,
+    startup_event, shutdown_event,
+)
 
 # Use httpx with AsyncClient and run synchronously
 import httpx
@@ -13,31 +17,25 @@ from httpx import ASGITransport
 
 class TestClient:
     """Synchronous test client wrapper for ASGI apps"""
-    def __init__(self, app):
+    def __init__(self, app, loop):
         self.app = app
         self.transport = ASGITransport(app=app)
-        self._loop = None
+        self._loop = loop
+        # One AsyncClient for the wrapper's lifetime instead of one per request
+        self._client = httpx.AsyncClient(transport=self.transport, base_url="http://test")
+        self._run_async(self._client.__aenter__())
     
-    def _get_loop(self):
-        """Get or create event loop"""
-        try:
-            return asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            return loop
+    def close(self):
+        """Close the underlying AsyncClient"""
+        self._run_async(self._client.__aexit__(None, None, None))
     
     def _run_async(self, coro):
         """Run async coroutine synchronously"""
-        loop = self._get_loop()
-        return loop.run_until_complete(coro)
+        return self._loop.run_until_complete(coro)
     
     def _make_request(self, method, url, **kwargs):
         """Make an async request synchronously"""
-        async def _request():
-            async with httpx.AsyncClient(transport=self.transport, base_url="http://test") as client:
-                return await client.request(method, url, **kwargs)
-        return self._run_async(_request())
+        return self._run_async(self._client.request(method, url, **kwargs))
     
     def get(self, url, **kwargs):
         return self._make_request("GET", url, **kwargs)
@@ -55,31 +53,42 @@ class TestClient:
         return self._make_request("PATCH", url, **kwargs)
 
 
-@pytest.fixture
-def client():
-    """Create a test client"""
-    return TestClient(app)
+def stored_files():
+    """List the files stored under the (sharded) upload directory"""
+    return [path for path in backend.main.UPLOAD_DIR.rglob("*") if path.is_file()]
+
+
+@pytest.fixture(scope="session")
+def event_loop():
+    """Create one event loop shared by the whole test session"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def client(event_loop):
+    """Create a test client shared by all tests"""
+    test_client = TestClient(app, event_loop)
+    yield test_client
+    test_client.close()
 
 
 @pytest.fixture(autouse=True)
-def setup_and_teardown():
-    """Setup and teardown for each test"""
-    # Clean up before test
-    if UPLOAD_DIR.exists():
-        shutil.rmtree(UPLOAD_DIR)
-    if METADATA_FILE.exists():
-        METADATA_FILE.unlink()
-    
-    # Create upload directory
-    UPLOAD_DIR.mkdir(exist_ok=True)
-    
+def setup_and_teardown(tmp_path, monkeypatch):
+    """Point uploads, metadata and in-memory state at a fresh per-test location"""
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    monkeypatch.setattr("backend.main.UPLOAD_DIR", upload_dir)
+    monkeypatch.setattr("backend.main.METADATA_FILE", tmp_path / "metadata.json")
+    monkeypatch.setattr("backend.main.METADATA", {})
+    monkeypatch.setattr("backend.main._SHA256_INDEX", {})
+    monkeypatch.setattr("backend.main._BY_DATE", SortedList())
+    # Cleared in place: tests inspect the cache object imported above
+    _DOWNLOAD_CACHE.clear()
     yield
-    
-    # Clean up after test
-    if UPLOAD_DIR.exists():
-        shutil.rmtree(UPLOAD_DIR)
-    if METADATA_FILE.exists():
-        METADATA_FILE.unlink()
+    _DOWNLOAD_CACHE.clear()
 
 
 def test_upload_valid_file(client):
@@ -101,12 +110,12 @@ def test_upload_valid_file(client):
     assert "upload_date" in data
     
     # Check file exists on disk
-    stored_path = UPLOAD_DIR / data["stored_filename"]
+    stored_path = _shard_path(data["stored_filename"])
     assert stored_path.exists()
     assert stored_path.read_bytes() == test_content
     
     # Check metadata file
-    metadata = json.loads(METADATA_FILE.read_text())
+    metadata = json.loads(backend.main.METADATA_FILE.read_text())
     assert data["id"] in metadata
 
 
@@ -129,6 +138,38 @@ def test_list_files(client):
     assert len(data["files"]) == 2
 
 
+def test_list_files_paginated(client):
+    """Test limit/offset/sort on the file listing"""
+    file_ids = []
+    for i in range(3):
+        files = {"file": (f"page{i}.txt", f"Page {i}".encode(), "text/plain")}
+        file_ids.append(client.post("/api/files/upload", files=files).json()["id"])
+    
+    response = client.get("/api/files/", params={"limit": 2})
+    data = response.json()
+    assert [f["id"] for f in data["files"]] == [file_ids[2], file_ids[1]]
+    assert data["count"] == 2
+    assert data["total"] == 3
+    
+    data = client.get("/api/files/", params={"offset": 2}).json()
+    assert [f["id"] for f in data["files"]] == [file_ids[0]]
+    
+    data = client.get("/api/files/", params={"sort": "oldest"}).json()
+    assert [f["id"] for f in data["files"]] == file_ids
+    
+    assert client.get("/api/files/", params={"limit": 0}).status_code == 422
+
+
+def test_list_files_unpaged_returns_all(client):
+    """Test that the listing returns every file when no limit is given"""
+    for i in range(51):
+        files = {"file": (f"all{i}.txt", f"All {i}".encode(), "text/plain")}
+        client.post("/api/files/upload", files=files)
+    
+    data = client.get("/api/files/").json()
+    assert data["count"] == data["total"] == 51
+
+
 def test_download_file(client):
     """Test downloading a specific file"""
     # Upload a file
@@ -146,6 +187,94 @@ def test_download_file(client):
     assert "download_test.txt" in response.headers.get("content-disposition", "")
 
 
+def test_small_download_cached_until_delete(client):
+    """Test that small files are served from memory and evicted when deleted"""
+    test_content = b"Cached download content"
+    files = {"file": ("cached.txt", test_content, "text/plain")}
+    
+    upload_response = client.post("/api/files/upload", files=files)
+    file_id = upload_response.json()["id"]
+    stored_filename = upload_response.json()["stored_filename"]
+    
+    response = client.get(f"/api/files/{file_id}")
+    assert response.status_code == 200
+    assert response.content == test_content
+    assert "cached.txt" in response.headers["content-disposition"]
+    assert _DOWNLOAD_CACHE[stored_filename] == test_content
+    
+    client.delete(f"/api/files/{file_id}")
+    assert stored_filename not in _DOWNLOAD_CACHE
+
+
+def test_large_download_uses_fd_pool(client):
+    """Test that larger files are streamed from a pooled descriptor that is closed on delete"""
+    content = os.urandom(512 * 1024)
+    files = {"file": ("large.pdf", content, "application/pdf")}
+    
+    upload_response = client.post("/api/files/upload", files=files)
+    file_id = upload_response.json()["id"]
+    stored_filename = upload_response.json()["stored_filename"]
+    
+    for _ in range(2):
+        response = client.get(f"/api/files/{file_id}")
+        assert response.status_code == 200
+        assert response.content == content
+    assert stored_filename in _FD_POOL
+    
+    # Range requests still go through FileResponse
+    response = client.get(f"/api/files/{file_id}", headers={"Range": "bytes=0-9"})
+    assert response.status_code == 206
+    assert response.content == content[:10]
+    
+    client.delete(f"/api/files/{file_id}")
+    assert stored_filename not in _FD_POOL
+
+
+def test_download_file_via_xaccel(client, monkeypatch):
+    """Test that downloads are delegated to nginx when X-Accel-Redirect is enabled"""
+    monkeypatch.setattr("backend.main.USE_XACCEL", True)
+    files = {"file": ("xaccel_test.txt", b"Served by nginx", "text/plain")}
+    
+    upload_response = client.post("/api/files/upload", files=files)
+    file_id = upload_response.json()["id"]
+    stored_filename = upload_response.json()["stored_filename"]
+    
+    response = client.get(f"/api/files/{file_id}")
+    
+    assert response.status_code == 200
+    assert response.headers["x-accel-redirect"] == (
+        f"/_protected_uploads/{stored_filename[:2]}/{stored_filename[2:4]}/{stored_filename}"
+    )
+    assert "xaccel_test.txt" in response.headers["content-disposition"]
+    assert response.content == b""
+
+
+def test_conditional_download(client):
+    """Test ETag/Last-Modified headers and 304 responses for download and info"""
+    files = {"file": ("etag_test.txt", b"Cacheable content", "text/plain")}
+    
+    upload_response = client.post("/api/files/upload", files=files)
+    file_id = upload_response.json()["id"]
+    
+    for url in (f"/api/files/{file_id}", f"/api/files/{file_id}/info"):
+        response = client.get(url)
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        assert upload_response.json()["stored_filename"] in etag
+        assert response.headers["cache-control"] == "private, max-age=3600"
+        
+        # Matching validators return an empty 304
+        cached = client.get(url, headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+        assert cached.content == b""
+        cached = client.get(url, headers={"If-Modified-Since": response.headers["last-modified"]})
+        assert cached.status_code == 304
+        
+        # A non-matching ETag returns the full response
+        stale = client.get(url, headers={"If-None-Match": '"other"'})
+        assert stale.status_code == 200
+
+
 def test_delete_file(client):
     """Test deleting a file"""
     # Upload a file
@@ -157,7 +286,7 @@ def test_delete_file(client):
     stored_filename = upload_response.json()["stored_filename"]
     
     # Verify file exists
-    stored_path = UPLOAD_DIR / stored_filename
+    stored_path = _shard_path(stored_filename)
     assert stored_path.exists()
     
     # Delete the file
@@ -172,10 +301,33 @@ def test_delete_file(client):
     assert not stored_path.exists()
     
     # Verify metadata is removed
-    metadata = json.loads(METADATA_FILE.read_text())
+    metadata = json.loads(backend.main.METADATA_FILE.read_text())
     assert file_id not in metadata
 
 
+def test_duplicate_upload_shares_stored_file(client):
+    """Test that identical content is stored once and kept until its last entry is deleted"""
+    content = b"Same bytes, different names"
+    first = client.post("/api/files/upload", files={"file": ("first.txt", content, "text/plain")}).json()
+    second = client.post("/api/files/upload", files={"file": ("second.txt", content, "text/plain")}).json()
+    
+    assert first["id"] != second["id"]
+    assert second["original_filename"] == "second.txt"
+    assert first["sha256"] == second["sha256"]
+    assert first["stored_filename"] == second["stored_filename"]
+    assert len(stored_files()) == 1
+    
+    # Deleting one entry keeps the shared file for the other
+    client.delete(f"/api/files/{first['id']}")
+    response = client.get(f"/api/files/{second['id']}")
+    assert response.status_code == 200
+    assert response.content == content
+    
+    # Deleting the last entry removes the file
+    client.delete(f"/api/files/{second['id']}")
+    assert not stored_files()
+
+
 def test_get_file_info(client):
     """Test getting file metadata without downloading"""
     # Upload a file
@@ -210,15 +362,30 @@ def test_upload_invalid_file_type(client):
 
 
 def test_upload_file_too_large(client):
-    """Test uploading a file that exceeds size limit"""
-    # Create a file larger than 10MB
-    large_content = b"x" * (11 * 1024 * 1024)  # 11MB
-    files = {"file": ("large.txt", large_content, "text/plain")}
-    
-    response = client.post("/api/files/upload", files=files)
+    """Test that a file exceeding the size limit is rejected before its body is read"""
+    chunks_sent = 0
+    
+    async def large_body():
+        nonlocal chunks_sent
+        for _ in range(11):
+            chunks_sent += 1
+            yield b"x" * (1024 * 1024)
+    
+    response = client.post(
+        "/api/files/upload",
+        content=large_body(),
+        headers={
+            "Content-Type": "multipart/form-data; boundary=boundary",
+            "Content-Length": str(11 * 1024 * 1024)
+        }
+    )
     
     assert response.status_code == 400
     assert "size" in response.json()["detail"].lower()
+    
+    # Rejected from Content-Length alone: none of the 11MB was read or stored
+    assert chunks_sent == 0
+    assert not stored_files()
 
 
 def test_download_nonexistent_file(client):
@@ -276,3 +443,35 @@ def test_upload_pdf_file(client):
     data = response.json()
     assert "pdf" in data["mime_type"].lower()
 
+
+def test_metadata_flushed_on_shutdown(client):
+    """Test that batched metadata changes are written when the app shuts down"""
+    client._run_async(startup_event())
+    files = {"file": ("flush_test.txt", b"Flush test", "text/plain")}
+    
+    response = client.post("/api/files/upload", files=files)
+    assert response.status_code == 201
+    file_id = response.json()["id"]
+    
+    client._run_async(shutdown_event())
+    
+    metadata = json.loads(backend.main.METADATA_FILE.read_text())
+    assert file_id in metadata
+
+
+def test_concurrent_metadata_flushes(client):
+    """Test that overlapping flushes (e.g. a cancelled flusher and the shutdown flush) don't collide"""
+    from concurrent.futures import ThreadPoolExecutor
+    import backend.main
+    files = {"file": ("concurrent_flush.txt", b"Flush test", "text/plain")}
+    file_id = client.post("/api/files/upload", files=files).json()["id"]
+    
+    def dirty_flush():
+        backend.main._DIRTY = True
+        backend.main.flush_metadata()
+    
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for future in [pool.submit(dirty_flush) for _ in range(64)]:
+            future.result()
+    
+    assert file_id in json.loads(backend.main.METADATA_FILE.read_text())
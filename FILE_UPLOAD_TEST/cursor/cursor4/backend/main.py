@@ -1,18 +1,58 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Path
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Path, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from contextlib import asynccontextmanager
 import os
-import json
-import uuid
+import secrets
 import shutil
-from datetime import datetime, timezone
+import time
+from functools import lru_cache
 from pathlib import Path as PathLib
 from typing import List, Optional
-import mimetypes
-import re
+import asyncio
+import threading
+import orjson
 
-app = FastAPI(title="File Upload & Management API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize directories, warm the metadata cache and run the background metadata flusher"""
+    global _FLUSH_TASK
+    ensure_directories()
+    await asyncio.to_thread(load_metadata)
+    _FLUSH_TASK = asyncio.create_task(_flush_loop())
+    yield
+    # Write queued metadata changes before exiting
+    await _stop_flush_loop()
+
+
+app = FastAPI(title="File Upload & Management API", lifespan=lifespan)
+
+
+class UploadSizeLimitMiddleware:
+    """Reject uploads whose declared Content-Length is too large before any of the body is read"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/api/files/upload":
+            try:
+                declared = int(Headers(scope=scope).get("content-length", 0))
+            except ValueError:
+                declared = 0
+            if declared > MAX_REQUEST_SIZE:
+                response = JSONResponse(status_code=413, content={"detail": FILE_TOO_LARGE_DETAIL})
+                await response(scope, receive, send)
+                return
+        # Uploads without a Content-Length are still limited while streaming
+        await self.app(scope, receive, send)
+
+
+# Registered before CORS so CORS headers are still added to its responses
+app.add_middleware(UploadSizeLimitMiddleware)
 
 # CORS middleware to allow frontend requests
 app.add_middleware(
@@ -27,49 +67,280 @@ app.add_middleware(
 UPLOAD_DIR = PathLib("uploads")
 METADATA_FILE = PathLib("metadata.json")
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+# Headroom for the multipart boundary and part headers around the file
+FORM_OVERHEAD_BUDGET = 64 * 1024
+MAX_REQUEST_SIZE = MAX_FILE_SIZE + FORM_OVERHEAD_BUDGET
+FILE_TOO_LARGE_DETAIL = f"File size exceeds maximum allowed size of {MAX_FILE_SIZE / (1024*1024)}MB"
+UPLOAD_CHUNK_SIZE = 64 * 1024  # 64KB
+DOWNLOAD_CACHE_CONTROL = "public, max-age=31536000, immutable"
 
 # Allowed file types
-ALLOWED_MIME_TYPES = {
+ALLOWED_MIME_TYPES = frozenset({
     "image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp",
     "application/pdf",
     "text/plain", "text/html", "text/css", "text/javascript", "text/csv",
     "application/json", "text/xml"
-}
+})
 
-ALLOWED_EXTENSIONS = {
+ALLOWED_EXTENSIONS = frozenset({
     ".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp",
     ".pdf",
     ".txt", ".html", ".css", ".js", ".csv", ".json", ".xml"
+})
+
+# MIME type stored for each allowed extension, so mimetypes.guess_type is
+# never needed on the upload path
+_EXT_TO_MIME = {
+    ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png",
+    ".gif": "image/gif", ".webp": "image/webp", ".bmp": "image/bmp",
+    ".pdf": "application/pdf",
+    ".txt": "text/plain", ".html": "text/html", ".css": "text/css",
+    ".js": "text/javascript", ".csv": "text/csv",
+    ".json": "application/json", ".xml": "text/xml"
 }
 
+# Path separators are dropped and characters unsafe in filenames replaced,
+# all in a single str.translate pass
+_SANITIZE_TABLE = str.maketrans({c: "_" for c in '<>:"|?*'} | {"/": "", "\\": ""})
+
 
 def ensure_directories():
     """Ensure upload directory exists"""
     UPLOAD_DIR.mkdir(exist_ok=True)
 
 
+# Metadata is persisted as a JSON snapshot (METADATA_FILE) plus an append-only
+# log of changes made since (one JSON line per upload or delete), so a change
+# costs one small append instead of rewriting every entry. The log is folded
+# back into the snapshot once it grows well past the number of entries.
+METADATA_LOG_MIN_COMPACT = 100
+
+# Parsed metadata and the signature of the files it was read from; they are
+# only re-read when that signature changes
+_METADATA_CACHE: Optional[dict] = None
+_METADATA_STAT: Optional[tuple] = None
+_METADATA_LOG_ENTRIES = 0
+# Listing order derived from the cached metadata, rebuilt only after it changes
+_FILES_NEWEST_FIRST: Optional[list] = None
+# Serializes load-modify-save cycles of the endpoints that change metadata
+_METADATA_LOCK = asyncio.Lock()
+# Keeps worker threads from reading the metadata files while they are written
+_METADATA_IO_LOCK = threading.RLock()
+
+# Changes are applied to the cached metadata immediately and queued; a
+# background task appends everything queued to the change log at most once per
+# FLUSH_INTERVAL_MS, so concurrent uploads share one write and fsync
+FLUSH_INTERVAL_MS = 200
+_PENDING_CHANGES: list = []
+_FLUSH_TASK: Optional[asyncio.Task] = None
+
+
+def metadata_log_path() -> PathLib:
+    """Return the path of the change log kept next to METADATA_FILE"""
+    return METADATA_FILE.with_name(METADATA_FILE.name + ".log")
+
+
+def _file_stat(path: PathLib) -> tuple:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return (None, None)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _metadata_stat() -> tuple:
+    """Return the signature used to tell whether the metadata files have changed"""
+    return (str(METADATA_FILE), _file_stat(METADATA_FILE), _file_stat(metadata_log_path()))
+
+
+def _apply_metadata_change(metadata: dict, record: dict):
+    """Apply one change log record to the metadata"""
+    if record["op"] == "put":
+        metadata[record["id"]] = record["meta"]
+    else:
+        metadata.pop(record["id"], None)
+
+
 def load_metadata() -> dict:
-    """Load metadata from JSON file"""
-    if METADATA_FILE.exists():
-        with open(METADATA_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+    """Load metadata, re-reading the snapshot and change log only when they changed on disk"""
+    global _METADATA_CACHE, _METADATA_STAT, _METADATA_LOG_ENTRIES, _FILES_NEWEST_FIRST
+    if _METADATA_CACHE is not None and _metadata_stat() == _METADATA_STAT:
+        return _METADATA_CACHE
+    with _METADATA_IO_LOCK:
+        stat = _metadata_stat()
+        if _METADATA_CACHE is not None and stat == _METADATA_STAT:
+            return _METADATA_CACHE
+        _FILES_NEWEST_FIRST = None
+        metadata = {}
+        if METADATA_FILE.exists():
+            with open(METADATA_FILE, "rb") as f:
+                metadata = orjson.loads(f.read())
+        log_entries = 0
+        try:
+            with open(metadata_log_path(), "rb") as f:
+                for line in f:
+                    try:
+                        record = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        # A torn final line from an interrupted append
+                        continue
+                    _apply_metadata_change(metadata, record)
+                    log_entries += 1
+        except FileNotFoundError:
+            pass
+        # Changes not yet written to the log still apply on top of the files
+        for record in _PENDING_CHANGES:
+            _apply_metadata_change(metadata, record)
+        _METADATA_CACHE = metadata
+        _METADATA_LOG_ENTRIES = log_entries
+        _METADATA_STAT = stat
+    # Shared with every caller; changes go through record_metadata_change
+    return _METADATA_CACHE
 
 
 def save_metadata(metadata: dict):
-    """Save metadata to JSON file"""
-    with open(METADATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    """Write a full metadata snapshot atomically, clear the change log and make it the cached copy"""
+    global _METADATA_CACHE, _METADATA_STAT, _METADATA_LOG_ENTRIES, _FILES_NEWEST_FIRST
+    with _METADATA_IO_LOCK:
+        _FILES_NEWEST_FIRST = None
+        tmp_file = METADATA_FILE.with_name(METADATA_FILE.name + ".tmp")
+        try:
+            with open(tmp_file, "wb") as f:
+                f.write(orjson.dumps(metadata))
+            os.replace(tmp_file, METADATA_FILE)
+            # Replaying the old log over the new snapshot is harmless, so a crash
+            # before this point loses nothing
+            metadata_log_path().unlink(missing_ok=True)
+        except Exception:
+            # The in-memory copy may no longer match the files; re-read them next time
+            _METADATA_CACHE = None
+            raise
+        _METADATA_CACHE = metadata
+        _METADATA_LOG_ENTRIES = 0
+        _METADATA_STAT = _metadata_stat()
+
+
+def record_metadata_change(op: str, file_id: str, meta: Optional[dict] = None):
+    """Apply an upload ("put") or delete ("del") to the cached metadata and queue it for the change log"""
+    global _FILES_NEWEST_FIRST
+    metadata = load_metadata()
+    record = {"op": op, "id": file_id}
+    if meta is not None:
+        record["meta"] = meta
+    _apply_metadata_change(metadata, record)
+    _PENDING_CHANGES.append(record)
+    _FILES_NEWEST_FIRST = None
+
+
+def flush_metadata():
+    """Append queued changes to the change log in one write, compacting it once it grows too long"""
+    global _METADATA_STAT, _METADATA_LOG_ENTRIES, _PENDING_CHANGES
+    if not _PENDING_CHANGES:
+        return
+    with _METADATA_IO_LOCK:
+        records, _PENDING_CHANGES = _PENDING_CHANGES, []
+        try:
+            with open(metadata_log_path(), "ab") as f:
+                f.write(b"".join(orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE) for record in records))
+                f.flush()
+                os.fsync(f.fileno())
+        except Exception:
+            _PENDING_CHANGES = records + _PENDING_CHANGES
+            raise
+        _METADATA_LOG_ENTRIES += len(records)
+        _METADATA_STAT = _metadata_stat()
+        
+        metadata = load_metadata()
+        if _METADATA_LOG_ENTRIES > max(4 * len(metadata), METADATA_LOG_MIN_COMPACT):
+            save_metadata(metadata)
+
+
+async def mark_metadata_dirty():
+    """Schedule queued metadata changes to be written by the background flusher"""
+    if _FLUSH_TASK is None:
+        # No flusher running (app used without lifespan events): write now
+        await asyncio.to_thread(flush_metadata)
+
+
+async def _flush_loop():
+    """Persist queued metadata changes every FLUSH_INTERVAL_MS"""
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL_MS / 1000)
+        if _PENDING_CHANGES:
+            async with _METADATA_LOCK:
+                await asyncio.to_thread(flush_metadata)
+
+
+async def _stop_flush_loop():
+    """Cancel the background flusher and write any queued changes"""
+    global _FLUSH_TASK
+    if _FLUSH_TASK is not None:
+        _FLUSH_TASK.cancel()
+        try:
+            await _FLUSH_TASK
+        except asyncio.CancelledError:
+            pass
+        _FLUSH_TASK = None
+    flush_metadata()
+
+
+def is_plain_filename(name: str) -> bool:
+    """Check that a stored filename names a file directly inside UPLOAD_DIR"""
+    return bool(name) and name not in (".", "..") and "/" not in name and "\\" not in name and "\0" not in name
+
+
+def etag_matches(if_none_match: Optional[str], file_id: str) -> bool:
+    """Check whether an If-None-Match header matches the ETag of a stored file"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == "*" or tag.strip('"') == file_id:
+            return True
+    return False
+
+
+def write_upload(source, file_path: PathLib) -> int:
+    """Copy an upload to disk in chunks, stopping once it exceeds MAX_FILE_SIZE; return the bytes read"""
+    size = 0
+    with open(file_path, "wb") as f:
+        while chunk := source.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > MAX_FILE_SIZE:
+                break
+            f.write(chunk)
+    return size
+
+
+def files_newest_first() -> list:
+    """Return all file metadata, newest upload first"""
+    global _FILES_NEWEST_FIRST
+    metadata = load_metadata()
+    if _FILES_NEWEST_FIRST is None:
+        # Entries are inserted as they are uploaded, so insertion order is
+        # upload order and reversing it replaces sorting by upload_date
+        _FILES_NEWEST_FIRST = list(reversed(metadata.values()))
+    return _FILES_NEWEST_FIRST
+
+
+@lru_cache(maxsize=1)
+def _utc_second_prefix(seconds: int) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+
+
+def utc_now_isoformat() -> str:
+    """Return the current UTC time in ISO 8601 format, reusing the formatted date for uploads within the same second"""
+    seconds, nanos = divmod(time.time_ns(), 1_000_000_000)
+    return f"{_utc_second_prefix(seconds)}.{nanos // 1000:06d}+00:00"
 
 
 def sanitize_filename(filename: str) -> str:
     """Sanitize filename to prevent path traversal and other attacks"""
-    # Remove path components
-    filename = os.path.basename(filename)
-    # Remove any remaining path separators
-    filename = filename.replace("/", "").replace("\\", "")
-    # Remove or replace dangerous characters
-    filename = re.sub(r'[<>:"|?*]', "_", filename)
+    # Remove path components, then any remaining path separators and
+    # dangerous characters
+    filename = os.path.basename(filename).translate(_SANITIZE_TABLE)
     # Limit length
     if len(filename) > 255:
         name, ext = os.path.splitext(filename)
@@ -77,48 +348,26 @@ def sanitize_filename(filename: str) -> str:
     return filename
 
 
-def is_allowed_file(filename: str, content_type: Optional[str] = None) -> bool:
-    """Check if file type is allowed"""
+def is_allowed_file(filename: str, content_type: Optional[str] = None, ext: Optional[str] = None) -> bool:
+    """Check if file type is allowed (pass ext if the caller already split it off)"""
     # Check extension
-    ext = os.path.splitext(filename)[1].lower()
-    has_valid_extension = ext in ALLOWED_EXTENSIONS
-    
-    # Check MIME type if provided
-    has_valid_mime_type = False
-    if content_type:
-        # Handle MIME type variations
-        base_type = content_type.split(";")[0].strip().lower()
-        if base_type in ALLOWED_MIME_TYPES:
-            has_valid_mime_type = True
-        else:
-            # Fallback: check if extension matches common MIME types
-            mime_type, _ = mimetypes.guess_type(filename)
-            if mime_type and mime_type.lower() in ALLOWED_MIME_TYPES:
-                has_valid_mime_type = True
+    if ext is None:
+        ext = os.path.splitext(filename)[1]
+    if ext.lower() in ALLOWED_EXTENSIONS:
+        return True
     
     # Accept if either extension or MIME type is valid
     # This handles cases where sanitization might remove the extension
-    return has_valid_extension or has_valid_mime_type
-
-
-@app.on_event("startup")
-async def startup_event():
-    """Initialize directories on startup"""
-    ensure_directories()
+    if content_type:
+        # Handle MIME type variations
+        return content_type.partition(";")[0].strip().lower() in ALLOWED_MIME_TYPES
+    return False
 
 
 @app.post("/api/files/upload")
 async def upload_file(file: UploadFile = File(...)):
     """Upload a file and store metadata"""
     try:
-        # Validate file size
-        contents = await file.read()
-        if len(contents) > MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=413,
-                detail=f"File size exceeds maximum allowed size of {MAX_FILE_SIZE / (1024*1024)}MB"
-            )
-        
         # Sanitize filename first to prevent path traversal
         if not file.filename:
             raise HTTPException(
@@ -136,41 +385,53 @@ async def upload_file(file: UploadFile = File(...)):
             )
         
         # Validate file type using sanitized filename
-        if not is_allowed_file(original_filename, file.content_type):
+        ext = os.path.splitext(original_filename)[1]
+        if not is_allowed_file(original_filename, file.content_type, ext):
             raise HTTPException(
                 status_code=400,
                 detail="File type not allowed. Only images, PDFs, and text files are permitted."
             )
         
         # Generate unique file ID and stored filename
-        file_id = str(uuid.uuid4())
-        ext = os.path.splitext(original_filename)[1]
+        file_id = secrets.token_hex(16)
         stored_filename = f"{file_id}{ext}"
+        # Checked once here so downloads and deletes can rely on it
+        if not is_plain_filename(stored_filename):
+            raise HTTPException(status_code=400, detail="Invalid filename")
         file_path = UPLOAD_DIR / stored_filename
         
         # Detect MIME type
-        mime_type, _ = mimetypes.guess_type(original_filename)
-        if not mime_type:
-            mime_type = file.content_type or "application/octet-stream"
+        mime_type = _EXT_TO_MIME.get(ext.lower()) or file.content_type or "application/octet-stream"
         
-        # Save file
-        with open(file_path, "wb") as f:
-            f.write(contents)
+        # Stream the file to a temporary name in a worker thread, never holding
+        # it in memory as a whole, and only move it into place once it passed
+        # the size check
+        tmp_path = UPLOAD_DIR / f".{stored_filename}.part"
+        try:
+            file_size = await asyncio.to_thread(write_upload, file.file, tmp_path)
+            if file_size > MAX_FILE_SIZE:
+                raise HTTPException(
+                    status_code=413,
+                    detail=FILE_TOO_LARGE_DETAIL
+                )
+            os.replace(tmp_path, file_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
         
         # Create metadata
         metadata = {
             "id": file_id,
             "original_filename": original_filename,
             "stored_filename": stored_filename,
-            "file_size": len(contents),
+            "file_size": file_size,
             "mime_type": mime_type,
-            "upload_date": datetime.now(timezone.utc).isoformat()
+            "upload_date": utc_now_isoformat()
         }
         
         # Save metadata
-        all_metadata = load_metadata()
-        all_metadata[file_id] = metadata
-        save_metadata(all_metadata)
+        async with _METADATA_LOCK:
+            await asyncio.to_thread(record_metadata_change, "put", file_id, metadata)
+            await mark_metadata_dirty()
         
         return JSONResponse(content=metadata, status_code=201)
     
@@ -184,39 +445,43 @@ async def upload_file(file: UploadFile = File(...)):
 async def list_files():
     """List all uploaded files with metadata"""
     try:
-        metadata = load_metadata()
-        # Convert dict to list of metadata objects
-        files_list = list(metadata.values())
-        # Sort by upload date (newest first)
-        files_list.sort(key=lambda x: x.get("upload_date", ""), reverse=True)
+        files_list = await asyncio.to_thread(files_newest_first)
         return {"files": files_list, "count": len(files_list)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listing files: {str(e)}")
 
 
 @app.get("/api/files/{file_id}")
-async def download_file(file_id: str = Path(..., description="File ID")):
+async def download_file(request: Request, file_id: str = Path(..., description="File ID")):
     """Download a specific file"""
     try:
-        metadata = load_metadata()
+        metadata = await asyncio.to_thread(load_metadata)
         
         if file_id not in metadata:
             raise HTTPException(status_code=404, detail="File not found")
         
         file_info = metadata[file_id]
-        file_path = UPLOAD_DIR / file_info["stored_filename"]
+        stored_filename = file_info["stored_filename"]
         
+        # Prevent path traversal; stored names are checked at upload time, so
+        # a plain name check replaces resolving both paths
+        if not is_plain_filename(stored_filename):
+            raise HTTPException(status_code=403, detail="Invalid file path")
+        
+        # Stored files never change after upload, so the file ID is a strong ETag
+        headers = {"Cache-Control": DOWNLOAD_CACHE_CONTROL, "ETag": f'"{file_id}"'}
+        if etag_matches(request.headers.get("if-none-match"), file_id):
+            return Response(status_code=304, headers=headers)
+        
+        file_path = UPLOAD_DIR / stored_filename
         if not file_path.exists():
             raise HTTPException(status_code=404, detail="File not found on disk")
         
-        # Prevent path traversal
-        if not file_path.resolve().is_relative_to(UPLOAD_DIR.resolve()):
-            raise HTTPException(status_code=403, detail="Invalid file path")
-        
         return FileResponse(
             path=str(file_path),
             filename=file_info["original_filename"],
-            media_type=file_info["mime_type"]
+            media_type=file_info["mime_type"],
+            headers=headers
         )
     
     except HTTPException:
@@ -229,7 +494,7 @@ async def download_file(file_id: str = Path(..., description="File ID")):
 async def get_file_info(file_id: str = Path(..., description="File ID")):
     """Get file metadata without downloading"""
     try:
-        metadata = load_metadata()
+        metadata = await asyncio.to_thread(load_metadata)
         
         if file_id not in metadata:
             raise HTTPException(status_code=404, detail="File not found")
@@ -246,24 +511,25 @@ async def get_file_info(file_id: str = Path(..., description="File ID")):
 async def delete_file(file_id: str = Path(..., description="File ID")):
     """Delete a file and its metadata"""
     try:
-        metadata = load_metadata()
-        
-        if file_id not in metadata:
-            raise HTTPException(status_code=404, detail="File not found")
-        
-        file_info = metadata[file_id]
-        file_path = UPLOAD_DIR / file_info["stored_filename"]
-        
-        # Delete file from filesystem
-        if file_path.exists():
+        async with _METADATA_LOCK:
+            metadata = await asyncio.to_thread(load_metadata)
+            
+            if file_id not in metadata:
+                raise HTTPException(status_code=404, detail="File not found")
+            
+            file_info = metadata[file_id]
+            stored_filename = file_info["stored_filename"]
+            
             # Prevent path traversal
-            if not file_path.resolve().is_relative_to(UPLOAD_DIR.resolve()):
+            if not is_plain_filename(stored_filename):
                 raise HTTPException(status_code=403, detail="Invalid file path")
-            file_path.unlink()
-        
-        # Remove metadata
-        del metadata[file_id]
-        save_metadata(metadata)
+            
+            # Delete file from filesystem
+            await asyncio.to_thread((UPLOAD_DIR / stored_filename).unlink, missing_ok=True)
+            
+            # Remove metadata
+            await asyncio.to_thread(record_metadata_change, "del", file_id)
+            await mark_metadata_dirty()
         
         return {"message": "File deleted successfully", "file_id": file_id}
     
@@ -1,47 +1,27 @@
 import pytest
 import os
 import json
-import tempfile
-import shutil
 import sys
+from datetime import datetime, timedelta
 from pathlib import Path
 from fastapi.testclient import TestClient
 
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from backend.main import app, UPLOAD_DIR, METADATA_FILE
+from backend.main import app, load_metadata, save_metadata, metadata_log_path
 
 # Create a test client
 client = TestClient(app)
 
 
 @pytest.fixture(autouse=True)
-def setup_test_environment():
-    """Setup and teardown test environment"""
-    # Create temporary directories
-    original_upload_dir = UPLOAD_DIR
-    original_metadata_file = METADATA_FILE
-    
-    # Use temporary directory for tests
-    temp_dir = tempfile.mkdtemp()
-    test_upload_dir = Path(temp_dir) / "uploads"
-    test_metadata_file = Path(temp_dir) / "metadata.json"
-    
-    # Monkey patch the paths
-    import backend.main
-    backend.main.UPLOAD_DIR = test_upload_dir
-    backend.main.METADATA_FILE = test_metadata_file
-    
-    # Create upload directory
-    test_upload_dir.mkdir(exist_ok=True)
-    
+def setup_test_environment(tmp_path, monkeypatch):
+    """Point uploads and metadata at a per-test temporary directory"""
+    monkeypatch.setattr("backend.main.UPLOAD_DIR", tmp_path / "uploads")
+    monkeypatch.setattr("backend.main.METADATA_FILE", tmp_path / "metadata.json")
+    (tmp_path / "uploads").mkdir()
     yield
-    
-    # Cleanup
-    shutil.rmtree(temp_dir)
-    backend.main.UPLOAD_DIR = original_upload_dir
-    backend.main.METADATA_FILE = original_metadata_file
 
 
 def test_upload_valid_file():
@@ -59,6 +39,7 @@ def test_upload_valid_file():
     assert data["file_size"] == len(test_file_content)
     assert data["mime_type"] in ["image/jpeg", "image/jpg"]
     assert "upload_date" in data
+    assert datetime.fromisoformat(data["upload_date"]).utcoffset() == timedelta(0)
     assert "stored_filename" in data
 
 
@@ -99,6 +80,22 @@ def test_list_files():
     assert uploaded_file_id in file_ids
 
 
+
+def test_list_files_newest_first():
+    """Test that files are listed newest first, including after changes"""
+    file_ids = []
+    for name in ("first.txt", "second.txt", "third.txt"):
+        files = {"file": (name, b"content", "text/plain")}
+        file_ids.append(client.post("/api/files/upload", files=files).json()["id"])
+    
+    response = client.get("/api/files/")
+    assert [f["id"] for f in response.json()["files"]] == file_ids[::-1]
+    
+    client.delete(f"/api/files/{file_ids[1]}")
+    response = client.get("/api/files/")
+    assert [f["id"] for f in response.json()["files"]] == [file_ids[2], file_ids[0]]
+
+
 def test_download_file():
     """Test downloading a specific file"""
     # Upload a file first
@@ -117,6 +114,24 @@ def test_download_file():
     assert "download_test.txt" in response.headers.get("content-disposition", "")
 
 
+def test_download_not_modified():
+    """Test that a download revalidated with the file's ETag returns 304"""
+    files = {"file": ("cached_download.txt", b"cached download", "text/plain")}
+    file_id = client.post("/api/files/upload", files=files).json()["id"]
+    
+    response = client.get(f"/api/files/{file_id}")
+    assert response.status_code == 200
+    assert response.headers["etag"] == f'"{file_id}"'
+    assert "immutable" in response.headers["cache-control"]
+    
+    response = client.get(f"/api/files/{file_id}", headers={"If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
+    assert response.content == b""
+    
+    response = client.get(f"/api/files/{file_id}", headers={"If-None-Match": '"other"'})
+    assert response.status_code == 200
+
+
 def test_delete_file():
     """Test deleting a file"""
     # Upload a file first
@@ -177,6 +192,21 @@ def test_file_size_limit():
     assert response.status_code == 413
     data = response.json()
     assert "exceeds maximum" in data["detail"].lower()
+    
+    # The partially written file is removed
+    import backend.main
+    assert not any(backend.main.UPLOAD_DIR.iterdir())
+
+
+def test_file_size_limit_checked_while_streaming():
+    """Test that a file just over 10MB, within the request headroom, is rejected while it is written"""
+    import backend.main
+    
+    files = {"file": ("just_over.txt", b"x" * (backend.main.MAX_FILE_SIZE + 1), "text/plain")}
+    response = client.post("/api/files/upload", files=files)
+    
+    assert response.status_code == 413
+    assert not any(backend.main.UPLOAD_DIR.iterdir())
 
 
 def test_path_traversal_prevention():
@@ -196,6 +226,62 @@ def test_path_traversal_prevention():
     assert "\\" not in data["original_filename"]
 
 
+
+def test_metadata_cached_until_file_changes():
+    """Test that parsed metadata is reused until the metadata files change on disk"""
+    import backend.main
+    
+    files = {"file": ("cached.txt", b"cached content", "text/plain")}
+    file_id = client.post("/api/files/upload", files=files).json()["id"]
+    
+    metadata = load_metadata()
+    assert file_id in metadata
+    assert load_metadata() is metadata
+    
+    # An external edit to the file is picked up on the next load
+    backend.main.METADATA_FILE.write_text("{}", encoding="utf-8")
+    metadata_log_path().unlink(missing_ok=True)
+    assert load_metadata() == {}
+    assert client.get(f"/api/files/{file_id}/info").status_code == 404
+
+def test_metadata_changes_appended_to_log():
+    """Test that uploads and deletes append to the change log until it is compacted"""
+    import backend.main
+    
+    files = {"file": ("logged.txt", b"logged content", "text/plain")}
+    file_id = client.post("/api/files/upload", files=files).json()["id"]
+    assert not backend.main.METADATA_FILE.exists()
+    
+    records = [json.loads(line) for line in metadata_log_path().read_text(encoding="utf-8").splitlines()]
+    assert [(r["op"], r["id"]) for r in records] == [("put", file_id)]
+    
+    client.delete(f"/api/files/{file_id}")
+    records = [json.loads(line) for line in metadata_log_path().read_text(encoding="utf-8").splitlines()]
+    assert [(r["op"], r["id"]) for r in records] == [("put", file_id), ("del", file_id)]
+    
+    # Compacting folds the log into the snapshot
+    save_metadata(load_metadata())
+    assert not metadata_log_path().exists()
+    assert json.loads(backend.main.METADATA_FILE.read_text(encoding="utf-8")) == {}
+
+def test_metadata_changes_coalesced_by_flusher():
+    """Test that changes queued while the background flusher runs are written together on shutdown"""
+    import backend.main
+    
+    with TestClient(app) as flushing_client:
+        file_ids = []
+        for i in range(3):
+            files = {"file": (f"batched{i}.txt", b"batched content", "text/plain")}
+            file_ids.append(flushing_client.post("/api/files/upload", files=files).json()["id"])
+        
+        # Visible straight away, even before the flusher writes them
+        assert [f["id"] for f in flushing_client.get("/api/files/").json()["files"]] == file_ids[::-1]
+    
+    assert backend.main._FLUSH_TASK is None
+    assert not backend.main._PENDING_CHANGES
+    records = [json.loads(line) for line in metadata_log_path().read_text(encoding="utf-8").splitlines()]
+    assert [r["id"] for r in records] == file_ids
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
 
@@ -1,19 +1,46 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Query
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 import os
-import json
+import hashlib
 import uuid
 import mimetypes
-import re
 from datetime import datetime, timezone
 from pathlib import Path
+from urllib.parse import quote
+from collections import OrderedDict
+import asyncio
 import aiofiles
+import aiosqlite
+import orjson
 
 app = FastAPI(title="File Upload & Management System", version="1.0.0")
 
+class UploadSizeLimitMiddleware:
+    """Reject uploads whose declared Content-Length is too large before any of the body is read"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/api/files/upload":
+            try:
+                declared = int(Headers(scope=scope).get("content-length", 0))
+            except ValueError:
+                declared = 0
+            if declared > MAX_REQUEST_SIZE:
+                response = JSONResponse(status_code=413, content={"detail": FILE_TOO_LARGE_DETAIL})
+                await response(scope, receive, send)
+                return
+        # Uploads without a Content-Length are still limited while streaming
+        await self.app(scope, receive, send)
+
+# Registered before CORS so CORS headers are still added to its responses
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # CORS middleware for frontend communication
 app.add_middleware(
     CORSMiddleware,
@@ -25,9 +52,18 @@ app.add_middleware(
 
 # Configuration
 UPLOAD_DIR = Path("uploads")
+DATABASE_FILE = Path("file_metadata.db")
+# Metadata used to be kept in this JSON file; it is imported into a newly created database
 METADATA_FILE = Path("file_metadata.json")
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-ALLOWED_MIME_TYPES = {
+# Headroom for the multipart boundary and part headers around the file
+MAX_REQUEST_SIZE = MAX_FILE_SIZE + 64 * 1024
+FILE_TOO_LARGE_DETAIL = "File too large. Maximum size is 10MB"
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB chunks when streaming uploads to disk
+# When served behind nginx, set this to an internal location aliased to
+# UPLOAD_DIR (e.g. "/_internal/uploads/") so downloads are sent by nginx
+ACCEL_REDIRECT_PREFIX = os.environ.get("ACCEL_REDIRECT_PREFIX")
+ALLOWED_MIME_TYPES = frozenset({
     # Images
     "image/jpeg", "image/jpg", "image/png", "image/gif", "image/bmp", "image/webp",
     # PDFs
@@ -35,7 +71,12 @@ ALLOWED_MIME_TYPES = {
     # Text files
     "text/plain", "text/csv", "text/html", "text/css", "text/javascript",
     "application/json", "application/xml"
-}
+})
+ALLOWED_EXTENSIONS = frozenset({
+    '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp',  # Images
+    '.pdf',  # PDF
+    '.txt', '.csv', '.html', '.css', '.js', '.json', '.xml'  # Text files
+})
 
 # Ensure upload directory exists
 UPLOAD_DIR.mkdir(exist_ok=True)
@@ -56,26 +97,191 @@ class FileInfo(BaseModel):
     mime_type: str
     upload_date: str
 
-# Utility functions
-def load_metadata() -> dict:
-    """Load file metadata from JSON file"""
-    if METADATA_FILE.exists():
-        try:
-            with open(METADATA_FILE, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return {}
-    return {}
+FILE_INFO_FIELDS = tuple(FileInfo.model_fields)
+
+# Metadata database
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    original_filename TEXT NOT NULL,
+    stored_filename TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    mime_type TEXT NOT NULL,
+    upload_date TEXT NOT NULL
+);
+"""
+# Bumped whenever migrate_db gains a step
+DB_VERSION = 3
+FILE_COLUMNS = "id, original_filename, stored_filename, file_size, mime_type, upload_date"
+FILE_INFO_COLUMNS = "id, original_filename, file_size, mime_type, upload_date"
+
+_db: Optional[aiosqlite.Connection] = None
+_db_path: Optional[Path] = None
+
+# Recently looked-up file records, so repeated downloads and info requests skip
+# the database; entries never change after upload, so deletes and reconnects
+# are the only invalidation needed
+RECORD_CACHE_SIZE = 1024
+_record_cache: "OrderedDict[str, Dict]" = OrderedDict()
+
+# Inserts and deletes run right away, so this connection reads its own changes,
+# but committing them (one fsync each) is batched by a background task that
+# commits at most once per METADATA_COMMIT_DELAY
+METADATA_COMMIT_DELAY = 0.05
+_commit_event: Optional[asyncio.Event] = None
+_commit_task: Optional[asyncio.Task] = None
+
+async def get_db() -> aiosqlite.Connection:
+    """Return the shared database connection, opening it on first use"""
+    global _db, _db_path
+    if _db is not None and _db_path == DATABASE_FILE:
+        return _db
+    await close_db()
+    path = DATABASE_FILE
+    db = await aiosqlite.connect(path)
+    db.row_factory = aiosqlite.Row
+    # Write-ahead logging: a commit appends only the changed pages to the log
+    # (instead of copying them to a rollback journal first) and readers never
+    # see a half-written commit
+    await db.execute("PRAGMA journal_mode = WAL")
+    await db.execute("PRAGMA synchronous = NORMAL")
+    await db.executescript(SCHEMA)
+    await migrate_db(db)
+    if _db is not None:
+        # Another request opened the database while this one was connecting
+        await db.close()
+        return _db
+    _db, _db_path = db, path
+    return db
+
+async def close_db():
+    """Close the shared database connection"""
+    global _db, _db_path
+    _record_cache.clear()
+    if _db is not None:
+        db, _db, _db_path = _db, None, None
+        await db.commit()
+        await db.close()
+
+async def commit_metadata(db: aiosqlite.Connection):
+    """Commit metadata changes, leaving it to the background committer when it runs"""
+    if _commit_event is not None:
+        _commit_event.set()
+    else:
+        # No background committer (app used without startup events)
+        await db.commit()
+
+async def metadata_commit_loop():
+    """Commit batched metadata changes once per METADATA_COMMIT_DELAY"""
+    while True:
+        await _commit_event.wait()
+        await asyncio.sleep(METADATA_COMMIT_DELAY)
+        _commit_event.clear()
+        if _db is not None:
+            await _db.commit()
+
+async def migrate_db(db: aiosqlite.Connection):
+    """Bring a newly created or older database up to DB_VERSION"""
+    async with db.execute("PRAGMA user_version") as cursor:
+        (version,) = await cursor.fetchone()
+    if version >= DB_VERSION:
+        return
+    if version < 1:
+        await import_legacy_metadata(db)
+    if version < 2:
+        # Content hashes let identical uploads share one stored file
+        await db.execute("ALTER TABLE files ADD COLUMN content_hash TEXT")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_files_content_hash ON files (content_hash)")
+    if version < 3:
+        # Covers every listed column in listing order, so a listing is one
+        # sequential scan of this index and never touches the table rows
+        await db.execute("DROP INDEX IF EXISTS idx_files_upload_date")
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_files_listing "
+            "ON files (upload_date DESC, id, original_filename, file_size, mime_type)"
+        )
+    await db.execute(f"PRAGMA user_version = {DB_VERSION}")
+    await db.commit()
+
+async def import_legacy_metadata(db: aiosqlite.Connection):
+    """Copy entries from the old JSON metadata file into a newly created database"""
+    metadata = {}
+    try:
+        async with aiofiles.open(METADATA_FILE, 'rb') as f:
+            raw = await f.read()
+        metadata = await asyncio.to_thread(orjson.loads, raw)
+    except (orjson.JSONDecodeError, FileNotFoundError):
+        metadata = {}
+    await db.executemany(
+        f"INSERT OR IGNORE INTO files ({FILE_COLUMNS}) "
+        "VALUES (:id, :original_filename, :stored_filename, :file_size, :mime_type, :upload_date)",
+        list(metadata.values())
+    )
+
+async def get_file_record(file_id: str) -> Optional[Dict]:
+    """Look up the metadata of one file"""
+    db = await get_db()
+    record = _record_cache.get(file_id)
+    if record is not None:
+        _record_cache.move_to_end(file_id)
+        return record
+    async with db.execute(f"SELECT {FILE_COLUMNS} FROM files WHERE id = ?", (file_id,)) as cursor:
+        row = await cursor.fetchone()
+    if row is None:
+        return None
+    record = dict(row)
+    cache_file_record(record)
+    return record
+
+def cache_file_record(record: Dict):
+    """Remember a file record, evicting the least recently used one when full"""
+    _record_cache[record["id"]] = record
+    _record_cache.move_to_end(record["id"])
+    if len(_record_cache) > RECORD_CACHE_SIZE:
+        _record_cache.popitem(last=False)
+
+async def insert_file_record(metadata: Dict, content_hash: str):
+    """Store the metadata of a newly uploaded file"""
+    db = await get_db()
+    await db.execute(
+        f"INSERT INTO files ({FILE_COLUMNS}, content_hash) "
+        "VALUES (:id, :original_filename, :stored_filename, :file_size, :mime_type, :upload_date, :content_hash)",
+        {**metadata, "content_hash": content_hash}
+    )
+    await commit_metadata(db)
+    cache_file_record(metadata)
+
+async def delete_file_record(file_id: str):
+    """Remove the metadata of one file"""
+    db = await get_db()
+    _record_cache.pop(file_id, None)
+    await db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+    await commit_metadata(db)
 
-def save_metadata(metadata: dict):
-    """Save file metadata to JSON file"""
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(metadata, f, indent=2)
+async def find_stored_file_by_hash(content_hash: str) -> Optional[str]:
+    """Return the stored filename of an existing file with the given content hash"""
+    db = await get_db()
+    async with db.execute("SELECT stored_filename FROM files WHERE content_hash = ? LIMIT 1", (content_hash,)) as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row is not None else None
+
+async def list_files_sorted(limit: Optional[int] = None, offset: int = 0) -> List[Dict]:
+    """Return the listing fields of one page of files (all of them without a limit), newest upload first"""
+    db = await get_db()
+    async with db.execute(
+        f"SELECT {FILE_INFO_COLUMNS} FROM files ORDER BY upload_date DESC LIMIT ? OFFSET ?",
+        (limit if limit is not None else -1, offset)
+    ) as cursor:
+        return [dict(row) for row in await cursor.fetchall()]
+
+# Utility functions
+# Path separators and characters not allowed in filenames, each replaced with '_'
+_SANITIZE_TABLE = str.maketrans({c: '_' for c in '<>:"/\\|?*'})
 
 def sanitize_filename(filename: str) -> str:
     """Sanitize filename to prevent path traversal and other security issues"""
     # Remove path separators and dangerous characters
-    filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
+    filename = filename.translate(_SANITIZE_TABLE)
     # Remove path traversal sequences (..)
     filename = filename.replace('..', '_')
     # Remove leading/trailing dots and spaces
@@ -90,15 +296,59 @@ def validate_file_type(content_type: str, filename: str) -> bool:
     if content_type not in ALLOWED_MIME_TYPES:
         return False
     
-    # Additional validation based on file extension
-    _, ext = os.path.splitext(filename.lower())
-    allowed_extensions = {
-        '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp',  # Images
-        '.pdf',  # PDF
-        '.txt', '.csv', '.html', '.css', '.js', '.json', '.xml'  # Text files
-    }
-    
-    return ext in allowed_extensions
+    # Additional validation based on file extension; only the extension is
+    # lowercased, not the whole filename
+    ext = os.path.splitext(filename)[1]
+    return ext.lower() in ALLOWED_EXTENSIONS
+
+def write_upload(source, file_path: Path, hasher, size_hint: int = 0) -> int:
+    """Copy and hash an upload in chunks and return the bytes read (stops once over MAX_FILE_SIZE)"""
+    # Stream in chunks so the upload is never held in memory as a whole; the
+    # size is checked as it grows since the declared size may be unknown. The
+    # whole copy runs in one worker thread rather than a thread hop per chunk
+    file_size = 0
+    with open(file_path, 'wb') as f:
+        preallocated = 0 < size_hint <= MAX_FILE_SIZE and preallocate(f.fileno(), size_hint)
+        while chunk := source.read(UPLOAD_CHUNK_SIZE):
+            file_size += len(chunk)
+            if file_size > MAX_FILE_SIZE:
+                break
+            hasher.update(chunk)
+            f.write(chunk)
+        if preallocated and file_size < size_hint:
+            # Fewer bytes arrived than announced; drop the unused reservation
+            f.truncate(file_size)
+    return file_size
+
+def preallocate(fd: int, size: int) -> bool:
+    """Reserve disk space for a file of the given size up front, if the filesystem supports it"""
+    # One contiguous allocation instead of growing the file chunk by chunk
+    if not hasattr(os, "posix_fallocate"):
+        return False
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError:
+        # Not supported by this filesystem (some tmpfs and NFS versions)
+        return False
+    return True
+
+def link_duplicate(existing_path: Path, file_path: Path) -> bool:
+    """Replace a freshly written file with a hard link to an identical stored file"""
+    tmp_path = file_path.with_name(file_path.name + ".link")
+    try:
+        os.link(existing_path, tmp_path)
+    except OSError:
+        # Gone meanwhile, or links unsupported: keep the separate copy
+        return False
+    os.replace(tmp_path, file_path)
+    return True
+
+def attachment_disposition(filename: str) -> str:
+    """Build a Content-Disposition header like FileResponse does for a download filename"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
 
 # API Endpoints
 @app.post("/api/files/upload", response_model=FileMetadata)
@@ -107,7 +357,7 @@ async def upload_file(file: UploadFile = File(...)):
     
     # Validate file size
     if file.size and file.size > MAX_FILE_SIZE:
-        raise HTTPException(status_code=413, detail="File too large. Maximum size is 10MB")
+        raise HTTPException(status_code=413, detail=FILE_TOO_LARGE_DETAIL)
     
     # Validate file type
     if not validate_file_type(file.content_type, file.filename):
@@ -117,84 +367,103 @@ async def upload_file(file: UploadFile = File(...)):
         )
     
     # Generate unique file ID and sanitize filename
-    file_id = str(uuid.uuid4())
+    file_id = uuid.uuid4().hex
     original_filename = sanitize_filename(file.filename)
-    file_extension = os.path.splitext(original_filename)[1]
-    stored_filename = f"{file_id}{file_extension}"
+    # Sanitized names have no path separators or leading dots, so the
+    # extension is simply everything from the last dot
+    dot = original_filename.rfind('.')
+    file_extension = original_filename[dot:] if dot >= 0 else ''
+    stored_filename = file_id + file_extension
     
     # Save file to disk
     file_path = UPLOAD_DIR / stored_filename
     try:
-        async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
-            file_size = len(content)
+        hasher = hashlib.sha256()
+        file_size = await asyncio.to_thread(write_upload, file.file, file_path, hasher, file.size or 0)
+        if file_size > MAX_FILE_SIZE:
+            raise HTTPException(status_code=413, detail=FILE_TOO_LARGE_DETAIL)
+    except HTTPException:
+        file_path.unlink(missing_ok=True)
+        raise
     except Exception as e:
+        file_path.unlink(missing_ok=True)
         raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
     
-    # Create metadata
-    metadata = FileMetadata(
-        id=file_id,
-        original_filename=original_filename,
-        stored_filename=stored_filename,
-        file_size=file_size,
-        mime_type=file.content_type,
-        upload_date=datetime.now(timezone.utc).isoformat()
-    )
+    # Create metadata; a plain dict with the FileMetadata fields, stored and
+    # serialized as is rather than validated and dumped through the model
+    metadata = {
+        "id": file_id,
+        "original_filename": original_filename,
+        "stored_filename": stored_filename,
+        "file_size": file_size,
+        "mime_type": file.content_type,
+        "upload_date": datetime.now(timezone.utc).isoformat()
+    }
+    
+    # Identical content is already stored: hard link to it and drop the new
+    # copy. Each entry keeps its own name, so deleting one leaves the others
+    content_hash = hasher.hexdigest()
+    existing_filename = await find_stored_file_by_hash(content_hash)
+    if existing_filename is not None:
+        await asyncio.to_thread(link_duplicate, UPLOAD_DIR / existing_filename, file_path)
     
     # Save metadata
-    all_metadata = load_metadata()
-    all_metadata[file_id] = metadata.model_dump()
-    save_metadata(all_metadata)
+    await insert_file_record(metadata, content_hash)
     
-    return metadata
+    return ORJSONResponse(metadata)
 
 @app.get("/api/files/", response_model=List[FileInfo])
-async def list_files():
-    """List all uploaded files with metadata"""
-    metadata = load_metadata()
-    files = []
-    
-    for file_id, file_data in metadata.items():
-        files.append(FileInfo(
-            id=file_id,
-            original_filename=file_data["original_filename"],
-            file_size=file_data["file_size"],
-            mime_type=file_data["mime_type"],
-            upload_date=file_data["upload_date"]
-        ))
-    
-    return sorted(files, key=lambda x: x.upload_date, reverse=True)
+async def list_files(
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size; all files when omitted"),
+    offset: int = Query(0, ge=0)
+):
+    """List uploaded files with metadata, newest first"""
+    # Sorted and paged by the database using the listing index; the rows
+    # already have exactly the FileInfo fields, so they are serialized directly
+    return ORJSONResponse(await list_files_sorted(limit, offset))
 
 @app.get("/api/files/{file_id}")
 async def download_file(file_id: str):
     """Download a specific file"""
-    metadata = load_metadata()
+    file_data = await get_file_record(file_id)
     
-    if file_id not in metadata:
+    if file_data is None:
         raise HTTPException(status_code=404, detail="File not found")
     
-    file_data = metadata[file_id]
+    if ACCEL_REDIRECT_PREFIX:
+        # Let the reverse proxy send the file itself with sendfile(2)
+        return Response(
+            media_type=file_data["mime_type"],
+            headers={
+                "X-Accel-Redirect": ACCEL_REDIRECT_PREFIX + quote(file_data["stored_filename"]),
+                "Content-Disposition": attachment_disposition(file_data["original_filename"])
+            }
+        )
+    
     file_path = UPLOAD_DIR / file_data["stored_filename"]
     
-    if not file_path.exists():
+    # One stat both checks the file exists and is handed to FileResponse,
+    # which would otherwise stat it again
+    try:
+        stat_result = os.stat(file_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found on disk")
     
     return FileResponse(
         path=file_path,
         filename=file_data["original_filename"],
-        media_type=file_data["mime_type"]
+        media_type=file_data["mime_type"],
+        stat_result=stat_result
     )
 
 @app.delete("/api/files/{file_id}")
 async def delete_file(file_id: str):
     """Delete a file and its metadata"""
-    metadata = load_metadata()
+    file_data = await get_file_record(file_id)
     
-    if file_id not in metadata:
+    if file_data is None:
         raise HTTPException(status_code=404, detail="File not found")
     
-    file_data = metadata[file_id]
     file_path = UPLOAD_DIR / file_data["stored_filename"]
     
     # Delete file from disk
@@ -205,27 +474,39 @@ async def delete_file(file_id: str):
             raise HTTPException(status_code=500, detail=f"Failed to delete file: {str(e)}")
     
     # Remove metadata
-    del metadata[file_id]
-    save_metadata(metadata)
+    await delete_file_record(file_id)
     
     return {"message": "File deleted successfully"}
 
 @app.get("/api/files/{file_id}/info", response_model=FileInfo)
 async def get_file_info(file_id: str):
     """Get file metadata without downloading"""
-    metadata = load_metadata()
+    file_data = await get_file_record(file_id)
     
-    if file_id not in metadata:
+    if file_data is None:
         raise HTTPException(status_code=404, detail="File not found")
     
-    file_data = metadata[file_id]
-    return FileInfo(
-        id=file_id,
-        original_filename=file_data["original_filename"],
-        file_size=file_data["file_size"],
-        mime_type=file_data["mime_type"],
-        upload_date=file_data["upload_date"]
-    )
+    return ORJSONResponse({field: file_data[field] for field in FILE_INFO_FIELDS})
+
+@app.on_event("startup")
+async def startup_event():
+    """Start the background metadata committer"""
+    global _commit_event, _commit_task
+    _commit_event = asyncio.Event()
+    _commit_task = asyncio.create_task(metadata_commit_loop())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the background committer, then commit and close the metadata database"""
+    global _commit_event, _commit_task
+    if _commit_task is not None:
+        _commit_task.cancel()
+        try:
+            await _commit_task
+        except asyncio.CancelledError:
+            pass
+    _commit_event, _commit_task = None, None
+    await close_db()
 
 @app.get("/")
 async def root():
@@ -9,7 +9,7 @@ import subprocess
 import webbrowser
 import time
 from pathlib import Path
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 import threading
 
 class CORSHTTPRequestHandler(SimpleHTTPRequestHandler):
@@ -39,8 +39,9 @@ def start_server(port=3000):
     print("🔄 Make sure the backend is running at http://localhost:8000")
     print("\n" + "="*50)
     
-    # Create and start the server
-    server = HTTPServer(('localhost', port), CORSHTTPRequestHandler)
+    # Create and start the server; each request is handled in its own thread
+    # so the page's assets are fetched concurrently rather than one at a time
+    server = ThreadingHTTPServer(('localhost', port), CORSHTTPRequestHandler)
     
     # Open browser after a short delay
     def open_browser():
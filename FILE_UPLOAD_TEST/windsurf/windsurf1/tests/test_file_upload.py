@@ -7,20 +7,24 @@ import shutil
 from pathlib import Path
 from fastapi.testclient import TestClient
 from io import BytesIO
+from urllib.parse import quote
 
 # Import the FastAPI app
 import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
-from main import app, UPLOAD_DIR, METADATA_FILE
+from main import app, UPLOAD_DIR, METADATA_FILE, DATABASE_FILE
 
 client = TestClient(app)
 
 @pytest.fixture(scope="function")
 def setup_test_environment():
     """Set up a clean test environment for each test"""
-    # Create temporary directories for testing
-    test_upload_dir = Path("test_uploads")
-    test_metadata_file = Path("test_file_metadata.json")
+    # Keep everything in one temporary directory, in memory (tmpfs) where
+    # available, so tests never touch the disk and cleanup is a single rmtree
+    test_dir = Path(tempfile.mkdtemp(dir="/dev/shm" if os.path.isdir("/dev/shm") else None))
+    test_upload_dir = test_dir / "uploads"
+    test_metadata_file = test_dir / "file_metadata.json"
+    test_database_file = test_dir / "file_metadata.db"
     
     # Backup original paths
     original_upload_dir = app.state.upload_dir if hasattr(app.state, 'upload_dir') else UPLOAD_DIR
@@ -34,6 +38,7 @@ def setup_test_environment():
     import main
     main.UPLOAD_DIR = test_upload_dir
     main.METADATA_FILE = test_metadata_file
+    main.DATABASE_FILE = test_database_file
     
     # Create test directories
     test_upload_dir.mkdir(exist_ok=True)
@@ -41,14 +46,13 @@ def setup_test_environment():
     yield
     
     # Cleanup after test
-    if test_upload_dir.exists():
-        shutil.rmtree(test_upload_dir)
-    if test_metadata_file.exists():
-        test_metadata_file.unlink()
+    asyncio.run(main.close_db())
+    shutil.rmtree(test_dir)
     
     # Restore original paths
     main.UPLOAD_DIR = original_upload_dir
     main.METADATA_FILE = original_metadata_file
+    main.DATABASE_FILE = DATABASE_FILE
 
 def create_test_file(filename: str, content: bytes, content_type: str):
     """Helper function to create test files"""
@@ -121,6 +125,66 @@ class TestFileUpload:
         assert response.status_code == 413
         assert "File too large" in response.json()["detail"]
     
+    def test_upload_file_too_large_rejected_before_reading(self, setup_test_environment):
+        """Test that an upload declaring a too large Content-Length is rejected before its body is read"""
+        import httpx
+        chunks_sent = 0
+        
+        async def large_body():
+            nonlocal chunks_sent
+            for _ in range(11):
+                chunks_sent += 1
+                yield b"x" * (1024 * 1024)
+        
+        async def post_large_body():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+                return await async_client.post(
+                    "/api/files/upload",
+                    content=large_body(),
+                    headers={
+                        "Content-Type": "multipart/form-data; boundary=boundary",
+                        "Content-Length": str(11 * 1024 * 1024)
+                    }
+                )
+        
+        response = asyncio.run(post_large_body())
+        
+        assert response.status_code == 413
+        assert "File too large" in response.json()["detail"]
+        assert chunks_sent == 0
+    
+    def test_upload_file_too_large_without_declared_size(self, setup_test_environment):
+        """Test that the size limit is enforced while streaming when the upload size is unknown"""
+        import main
+        from fastapi import HTTPException, UploadFile
+        from starlette.datastructures import Headers
+        
+        upload = UploadFile(
+            file=BytesIO(b"x" * (main.MAX_FILE_SIZE + 1)),
+            filename="large_file.txt",
+            headers=Headers({"content-type": "text/plain"}),
+        )
+        assert upload.size is None
+        
+        with pytest.raises(HTTPException) as exc_info:
+            asyncio.run(main.upload_file(upload))
+        
+        assert exc_info.value.status_code == 413
+        # The partially written file is removed
+        assert list(main.UPLOAD_DIR.iterdir()) == []
+    
+    def test_preallocated_upload_trimmed_to_bytes_received(self, setup_test_environment):
+        """Test that space reserved from an overstated size hint is released after the copy"""
+        import main
+        import hashlib
+        file_path = main.UPLOAD_DIR / "preallocated.txt"
+        
+        file_size = main.write_upload(BytesIO(b"short content"), file_path, hashlib.sha256(), size_hint=4096)
+        
+        assert file_size == len(b"short content")
+        assert file_path.read_bytes() == b"short content"
+    
     def test_filename_sanitization(self, setup_test_environment):
         """Test that dangerous filenames are sanitized"""
         text_content = b"Test content"
@@ -165,6 +229,58 @@ class TestFileManagement:
         assert data[0]["original_filename"] == "test.txt"
         assert data[0]["mime_type"] == "text/plain"
     
+    def test_list_files_newest_first(self, setup_test_environment):
+        """Test that files are listed newest upload first"""
+        uploaded_ids = []
+        for filename in ("first.txt", "second.txt", "third.txt"):
+            files = {"file": (filename, BytesIO(b"content"), "text/plain")}
+            uploaded_ids.append(client.post("/api/files/upload", files=files).json()["id"])
+        
+        response = client.get("/api/files/")
+        
+        assert response.status_code == 200
+        assert [f["id"] for f in response.json()] == uploaded_ids[::-1]
+    
+    def test_list_files_paginated(self, setup_test_environment):
+        """Test paging through the file list with limit and offset"""
+        uploaded_ids = []
+        for filename in ("first.txt", "second.txt", "third.txt"):
+            files = {"file": (filename, BytesIO(filename.encode()), "text/plain")}
+            uploaded_ids.append(client.post("/api/files/upload", files=files).json()["id"])
+        
+        response = client.get("/api/files/", params={"limit": 2})
+        assert [f["id"] for f in response.json()] == uploaded_ids[:0:-1]
+        
+        response = client.get("/api/files/", params={"limit": 2, "offset": 2})
+        assert [f["id"] for f in response.json()] == uploaded_ids[:1]
+        assert set(response.json()[0]) == {"id", "original_filename", "file_size", "mime_type", "upload_date"}
+        
+        assert client.get("/api/files/", params={"limit": 0}).status_code == 422
+    
+    def test_legacy_json_metadata_imported(self, setup_test_environment):
+        """Test that metadata from the old JSON file is imported into a new database once"""
+        import main
+        legacy = {
+            "legacy-id": {
+                "id": "legacy-id",
+                "original_filename": "legacy.txt",
+                "stored_filename": "legacy-id.txt",
+                "file_size": 6,
+                "mime_type": "text/plain",
+                "upload_date": "2024-01-01T12:00:00+00:00"
+            }
+        }
+        main.METADATA_FILE.write_text(json.dumps(legacy))
+        
+        response = client.get("/api/files/legacy-id/info")
+        assert response.status_code == 200
+        assert response.json()["original_filename"] == "legacy.txt"
+        
+        # Deleting it is not undone by a later re-import
+        assert client.delete("/api/files/legacy-id").status_code == 200
+        asyncio.run(main.close_db())
+        assert client.get("/api/files/legacy-id/info").status_code == 404
+    
     def test_download_file(self, setup_test_environment):
         """Test downloading an uploaded file"""
         # Upload a test file first
@@ -182,6 +298,34 @@ class TestFileManagement:
         assert response.content == text_content
         assert response.headers["content-type"] == "text/plain; charset=utf-8"
     
+    def test_download_offloaded_to_proxy(self, setup_test_environment, monkeypatch):
+        """Test that downloads are handed to the reverse proxy when X-Accel-Redirect is configured"""
+        import main
+        monkeypatch.setattr(main, "ACCEL_REDIRECT_PREFIX", "/_internal/uploads/")
+        files = {"file": ("report final.txt", BytesIO(b"Offloaded content"), "text/plain")}
+        data = client.post("/api/files/upload", files=files).json()
+        
+        response = client.get(f"/api/files/{data['id']}")
+        
+        assert response.status_code == 200
+        assert response.content == b""
+        assert response.headers["x-accel-redirect"] == f"/_internal/uploads/{data['stored_filename']}"
+        assert response.headers["content-disposition"] == "attachment; filename*=utf-8''report%20final.txt"
+        assert response.headers["content-type"].startswith("text/plain")
+    
+    def test_download_offloaded_to_proxy_non_ascii_name(self, setup_test_environment, monkeypatch):
+        """Test that a stored name with non-ASCII characters is percent-encoded in X-Accel-Redirect"""
+        import main
+        monkeypatch.setattr(main, "ACCEL_REDIRECT_PREFIX", "/_internal/uploads/")
+        files = {"file": ("a.中..txt", BytesIO(b"Offloaded content"), "text/plain")}
+        data = client.post("/api/files/upload", files=files).json()
+        assert not data["stored_filename"].isascii()
+        
+        response = client.get(f"/api/files/{data['id']}")
+        
+        assert response.status_code == 200
+        assert response.headers["x-accel-redirect"] == f"/_internal/uploads/{quote(data['stored_filename'])}"
+    
     def test_download_nonexistent_file(self, setup_test_environment):
         """Test downloading a file that doesn't exist"""
         fake_id = "nonexistent-file-id"
@@ -236,6 +380,60 @@ class TestFileManagement:
         files_list = list_response.json()
         assert len(files_list) == 0
     
+    def test_file_record_cache_invalidated_on_delete(self, setup_test_environment):
+        """Test that looked-up file records are cached until the file is deleted"""
+        import main
+        files = {"file": ("cached.txt", BytesIO(b"cached"), "text/plain")}
+        file_id = client.post("/api/files/upload", files=files).json()["id"]
+        
+        assert client.get(f"/api/files/{file_id}/info").status_code == 200
+        assert file_id in main._record_cache
+        
+        assert client.delete(f"/api/files/{file_id}").status_code == 200
+        assert file_id not in main._record_cache
+        assert client.get(f"/api/files/{file_id}/info").status_code == 404
+    
+    def test_batched_commits_persisted_on_shutdown(self, setup_test_environment):
+        """Test that changes committed by the background committer are all on disk after shutdown"""
+        import main
+        import sqlite3
+        
+        with TestClient(app) as committing_client:
+            uploaded_ids = []
+            for filename in ("a.txt", "b.txt", "c.txt"):
+                files = {"file": (filename, BytesIO(b"content"), "text/plain")}
+                uploaded_ids.append(committing_client.post("/api/files/upload", files=files).json()["id"])
+            assert committing_client.delete(f"/api/files/{uploaded_ids[0]}").status_code == 200
+            
+            # Visible to the app straight away, before any commit
+            assert len(committing_client.get("/api/files/").json()) == 2
+        
+        assert main._commit_task is None
+        conn = sqlite3.connect(main.DATABASE_FILE)
+        try:
+            stored_ids = {row[0] for row in conn.execute("SELECT id FROM files")}
+        finally:
+            conn.close()
+        assert stored_ids == set(uploaded_ids[1:])
+    
+    def test_identical_uploads_share_stored_file(self, setup_test_environment):
+        """Test that identical content is stored once, hard linked under each upload's name"""
+        import main
+        content = b"Same bytes uploaded twice"
+        first = client.post("/api/files/upload", files={"file": ("first.txt", BytesIO(content), "text/plain")}).json()
+        second = client.post("/api/files/upload", files={"file": ("second.txt", BytesIO(content), "text/plain")}).json()
+        
+        first_stat = (main.UPLOAD_DIR / first["stored_filename"]).stat()
+        second_stat = (main.UPLOAD_DIR / second["stored_filename"]).stat()
+        assert first_stat.st_ino == second_stat.st_ino
+        assert second_stat.st_nlink == 2
+        
+        # Deleting one upload leaves the other intact
+        assert client.delete(f"/api/files/{first['id']}").status_code == 200
+        response = client.get(f"/api/files/{second['id']}")
+        assert response.status_code == 200
+        assert response.content == content
+    
     def test_delete_nonexistent_file(self, setup_test_environment):
         """Test deleting a file that doesn't exist"""
         fake_id = "nonexistent-file-id"
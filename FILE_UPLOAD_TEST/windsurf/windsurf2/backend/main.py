@@ -8,7 +8,7 @@ import mimetypes
 from datetime import datetime, timezone
 from pathlib import Path
 import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 import shutil
 
 app = FastAPI(title="File Upload & Management API", version="1.0.0")
@@ -40,23 +40,47 @@ ALLOWED_MIME_TYPES = {
 # Create upload directory if it doesn't exist
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# Parsed metadata, reused until the file's stat signature changes, so reads
+# do not re-parse the JSON file and only mutations touch the disk. The cached
+# dict is shared: handlers copy it before changing it. All endpoints run on the
+# event loop and never await between load and save, so no lock is needed.
+_metadata_cache: Dict[str, Any] = {"key": None, "data": None}
+
+def _metadata_key() -> Tuple:
+    """Return a signature of METADATA_FILE that changes whenever the file does."""
+    try:
+        st = os.stat(METADATA_FILE)
+    except OSError:
+        return (str(METADATA_FILE), None, None)
+    return (str(METADATA_FILE), st.st_mtime_ns, st.st_size)
+
 def load_metadata() -> Dict[str, Any]:
-    """Load file metadata from JSON file."""
-    if METADATA_FILE.exists():
+    """Load file metadata from JSON file, reusing the parsed copy while the file is unchanged."""
+    key = _metadata_key()
+    if _metadata_cache["data"] is not None and _metadata_cache["key"] == key:
+        return _metadata_cache["data"]
+    data = {}
+    if key[1] is not None:
         try:
             with open(METADATA_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+                data = json.load(f)
         except (json.JSONDecodeError, IOError):
-            return {}
-    return {}
+            data = {}
+    _metadata_cache["key"] = key
+    _metadata_cache["data"] = data
+    return data
 
 def save_metadata(metadata: Dict[str, Any]) -> None:
-    """Save file metadata to JSON file."""
+    """Save file metadata to JSON file atomically and keep it as the cached copy."""
+    tmp_file = METADATA_FILE.with_name(METADATA_FILE.name + ".tmp")
     try:
-        with open(METADATA_FILE, 'w', encoding='utf-8') as f:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(metadata, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_file, METADATA_FILE)
     except IOError as e:
         raise HTTPException(status_code=500, detail=f"Failed to save metadata: {str(e)}")
+    _metadata_cache["key"] = _metadata_key()
+    _metadata_cache["data"] = metadata
 
 def sanitize_filename(filename: str) -> str:
     """Sanitize filename to prevent path traversal and other security issues."""
@@ -131,8 +155,9 @@ async def upload_file(file: UploadFile = File(...)):
         "upload_date": datetime.now(timezone.utc).isoformat()
     }
     
-    # Load existing metadata and add new file
-    all_metadata = load_metadata()
+    # Load existing metadata and add new file (to a copy, so the cache only
+    # changes once the file is saved)
+    all_metadata = dict(load_metadata())
     all_metadata[file_id] = metadata
     save_metadata(all_metadata)
     
@@ -167,7 +192,8 @@ async def download_file(file_id: str):
 @app.delete("/api/files/{file_id}")
 async def delete_file(file_id: str):
     """Delete a file and its metadata."""
-    metadata = load_metadata()
+    # Copy, so the cache only changes once the file is saved
+    metadata = dict(load_metadata())
     
     if file_id not in metadata:
         raise HTTPException(status_code=404, detail="File not found")
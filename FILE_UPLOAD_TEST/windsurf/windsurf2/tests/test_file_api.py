@@ -236,6 +236,38 @@ class TestFileAPI:
         assert response.status_code == 404
         assert "File not found" in response.json()["detail"]
 
+    def test_metadata_cached_until_file_changes(self, client):
+        """Test that parsed metadata is reused until the metadata file changes on disk."""
+        import main
+        files = {"file": ("cached.txt", BytesIO(b"Cached content"), "text/plain")}
+        file_id = client.post("/api/files/upload", files=files).json()["id"]
+        
+        metadata = main.load_metadata()
+        assert file_id in metadata
+        assert main.load_metadata() is metadata
+        
+        # An external edit to the file is picked up on the next load
+        self.temp_metadata_file.write_text("{}", encoding="utf-8")
+        assert main.load_metadata() == {}
+        assert client.get(f"/api/files/{file_id}/info").status_code == 404
+
+    def test_failed_metadata_save_keeps_cache(self, client, monkeypatch):
+        """Test that a failed metadata save leaves the cached metadata matching the file on disk."""
+        import main
+        files = {"file": ("kept.txt", BytesIO(b"Kept content"), "text/plain")}
+        file_id = client.post("/api/files/upload", files=files).json()["id"]
+        
+        def failing_replace(src, dst):
+            raise IOError("disk full")
+        
+        monkeypatch.setattr(main.os, "replace", failing_replace)
+        response = client.delete(f"/api/files/{file_id}")
+        assert response.status_code == 500
+        monkeypatch.undo()
+        
+        assert file_id in main.load_metadata()
+        assert client.get(f"/api/files/{file_id}/info").status_code == 200
+
     def test_upload_pdf_file(self, client):
         """Test uploading a PDF file."""
         # Minimal PDF content